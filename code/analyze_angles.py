@@ -14,10 +14,20 @@ from plotly import tools
 import plotly.graph_objs as go
 from plotly.offline import download_plotlyjs, init_notebook_mode, plot, iplot
 
+from event_timeline import play_window, player_events
+from instrument import RunReport
+from key_index import KeyIndex
+from ngs_schema import read_ngs_csv
+from trajectory_store import TrajectoryStore
+from trim_ngs_data import load_target_keys, read_store_target
+
 pd.set_option('display.max_rows', 5000)
 
 ## VARIABLES
 WDIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/data/'
+TDIR = f'{WDIR}trajectories/'
+USE_STORE = False # read injury set from columnar store (see ngs_store.py) instead of CSV
+USE_TRAJ_STORE = False # read plays from trajectory store (see trajectory_store.py)
 YD_TO_M = 0.9144 # multiplicative factor for converting yards to meters
 
 
@@ -69,32 +79,11 @@ def find_impact(pp_df):
             NGS data for player/partner pair.
     """
 
-    # Figure out where the ball snap occurred and get the index so that we can
-    # discard all data prior to that instant.
-    try:
-        play_st = pp_df.loc[pp_df.Event == 'punt'].index[0]
-    except IndexError:
-        try:
-            play_st = pp_df.loc[pp_df.Event == 'ball_snap'].index[0]
-        except IndexError:
-            play_st = pp_df.index.min()
-
-    # Figure out where the play "ended" so that we can discard all data after
-    # that. For simplicity, we assume that any concussion event would have occured
-    # prior to a penalty flag being thrown or within five seconds of a tackle.
-    try:
-        play_ei = pp_df.loc[pp_df.Event == 'penalty_flag'].index[0]
-    except IndexError:
-        try:
-            play_ei = pp_df.loc[pp_df.Event == 'tackle'].index[0] + 50
-
-            play_ps = pp_df.loc[pp_df.Event == 'play_submit'].index[0]
-
-            while play_ei > play_ps:
-                play_ei -= 10
-
-        except IndexError:
-            play_ei = pp_df.index.max()
+    # Figure out where the play started (punt/snap) and "ended" (penalty flag
+    # or shortly after the tackle) - see event_timeline.play_window. Frames
+    # here are rows of the merged player/partner data, so the events are found
+    # in pp_df itself rather than in a saved timeline.
+    play_st, play_ei = play_window(player_events(pp_df), len(pp_df))
 
     # Slice out the data that we actually need.
     pp_df = pp_df.iloc[play_st:play_ei].reset_index(drop=True)
@@ -106,6 +95,10 @@ def find_impact(pp_df):
     # Grab a few rows around that index.
     min_dis_df = pp_df.iloc[(min_dis_index-5):(min_dis_index+5)]
     min_dis_df.loc[min_dis_index,'impact'] = 1
+
+    # Categorical columns (e.g., Event) won't accept 0 as a fill value.
+    cat_cols = min_dis_df.select_dtypes('category').columns
+    min_dis_df = min_dis_df.astype({x: object for x in cat_cols})
     min_dis_df.fillna(0, inplace=True)
     min_dis_df.reset_index(drop=True, inplace=True)
 
@@ -190,33 +183,53 @@ def make_radial_plot(plot_df, angle_opt):
 ## MAIN
 if __name__ == '__main__':
 
-    # Load data.
-    inj_df = pd.read_csv(f'{WDIR}injury_ngs_data.csv')
-
-    # Add column for easy indexing.
     merge_cols = ['Season_Year', 'GameKey', 'PlayID']
-    ind_df = inj_df.drop_duplicates(merge_cols).reset_index(drop=True)
-    ind_df.loc[:, 'eventIndex'] = ind_df.index.values
 
-    ind_df = ind_df.loc[:, ['eventIndex', 'Season_Year', 'GameKey', 'PlayID']]
-    inj_df = inj_df.merge(ind_df, how='outer', left_on=merge_cols, right_on=merge_cols)
+    # Keep track of where the time goes (see instrument.py).
+    report = RunReport('analyze_angles')
+
+    if USE_TRAJ_STORE:
+        # Plays come straight out of the trajectory store, so we can get the
+        # player-partner data one play at a time.
+        store = TrajectoryStore(f'{TDIR}injury_ngs_data')
+        pp_plays = (calculate_pp_distance(sing_df.assign(eventIndex=play_idx))
+                    for play_idx, (_, sing_df) in enumerate(store.iter_plays()))
+    else:
+        with report.stage('load') as stage:
+            # Load data (just the injury games, if reading from the store).
+            if USE_STORE:
+                inj_df = read_store_target(load_target_keys('video_injury'))
+            else:
+                inj_df = read_ngs_csv(f'{WDIR}injury_ngs_data.csv')
 
-    # Get player-partner processed DataFrame.
-    play_part_df = calculate_pp_distance(inj_df)
+            # Add column for easy indexing (plays numbered in order of appearance).
+            inj_df.loc[:, 'eventIndex'] = inj_df.groupby(merge_cols, sort=False).ngroup()
+
+            # Get player-partner processed DataFrame.
+            play_part_df = calculate_pp_distance(inj_df)
+            stage.rows(n_in=len(inj_df), n_out=len(play_part_df))
+
+        pp_plays = (sp_df for _, sp_df in KeyIndex(play_part_df, ['eventIndex']))
 
     # Step through each play, identifying the most likely point of impact and
     # grabbing a few rows around it.
     impacts = []
 
-    for play_idx in range(len(inj_df.eventIndex.unique())):
-        try:
-            sp_df = play_part_df.loc[play_part_df.eventIndex == play_idx].reset_index(drop=True)
+    for sp_df in pp_plays:
+        with report.stage('find_impact') as stage:
+            try:
+                sp_df = sp_df.reset_index(drop=True)
+                stage.rows(n_in=len(sp_df))
 
-            # Find most probable time for impact between player/partner.
-            impact_df = find_impact(sp_df)
-            impacts.append(impact_df)
-        except TypeError:
-            continue
+                # Find most probable time for impact between player/partner.
+                impact_df = find_impact(sp_df)
+                impacts.append(impact_df)
+
+                stage.rows(n_out=len(impact_df))
+                stage.process()
+            except TypeError:
+                stage.fail('TypeError')
+                continue
 
     pp_impact_df = pd.concat(impacts, ignore_index=True)
 
@@ -253,3 +266,5 @@ if __name__ == '__main__':
 
     ODIR = f'/Users/cbonfield/Projects/kaggle/nfl_punts/figures/rel_angles/'
     pio.write_image(figure, f'{ODIR}{plt_opt}_rel_angles.pdf')
+
+    report.write()
@@ -8,40 +8,27 @@
 
 ## IMPORTS
 import glob
-import numpy as np
 import pandas as pd
 
-from scipy import interpolate
-
 import plotly.io as pio
 from plotly import tools
 import plotly.graph_objs as go
 from plotly.offline import download_plotlyjs, init_notebook_mode, plot, iplot
 
+from ecdf_tables import ECDFTables
+from instrument import RunReport
+
 ## VARIABLES
 SDIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/data/sumdynamics/'
 ODIR = f'/Users/cbonfield/Projects/kaggle/nfl_punts/figures/'
 
-## FUNCTIONS
-def ecdf(data):
-    """
-    Compute empirical cumulative distribution function for set of 1D data.
-
-    Parameters:
-        data: np.array
-    Returns:
-        x: np.array
-            Sorted data.
-        y: np.array
-            ECDF(x).
-    """
-
-    n = len(data)
-    x = np.sort(data)
-    y = np.arange(1, n+1) / n
-
-    return x, y
+# Cutoff for unreasonable accelerations. Backward differences amplify the
+# tracking noise, so this is needed for dynamics computed with the default
+# method in preprocess_ngs_data.compute_dynamics; set to None for dynamics
+# computed with method='savgol'.
+MAX_A = 150.
 
+## FUNCTIONS
 def make_histogram(ngs_df, col_to_plot, add_lines=False):
     """
     Generate plotly histogram using maximum accelerations experienced by
@@ -126,24 +113,34 @@ def plot_ecdf(int_ecdf, inj_ecdf, max_x):
 ## MAIN
 if __name__ == '__main__':
 
+    # Keep track of where the time goes (see instrument.py).
+    report = RunReport('characterize_concussions')
+
     # Load data.
-    files = glob.glob(f'{SDIR}*.csv')
-    flist = []
+    with report.stage('load') as stage:
+        files = glob.glob(f'{SDIR}*-summary.csv')
+        flist = []
+
+        for f in files:
+            tmp_df = pd.read_csv(f)
+            flist.append(tmp_df)
 
-    for f in files:
-        tmp_df = pd.read_csv(f)
-        flist.append(tmp_df)
+        sum_df = pd.concat(flist, ignore_index=True)
+        stage.rows(n_in=len(sum_df))
 
-    sum_df = pd.concat(flist, ignore_index=True)
+        # Drop unreasonable accelerations.
+        if MAX_A is not None:
+            stage.skip('max_a', (sum_df.max_a > MAX_A).sum())
+            sum_df = sum_df.loc[sum_df.max_a <= MAX_A]
 
-    # Drop unreasonable accelerations.
-    sum_df = sum_df.loc[sum_df.max_a <= 150.]
+        stage.rows(n_out=len(sum_df))
 
-    # Construct ECDF for players.
-    srt_spds, spd_ecdf = ecdf(sum_df.max_s.values)
-    int_s_ecdf = interpolate.interp1d(srt_spds, spd_ecdf)
-    srt_accs, acc_ecdf = ecdf(sum_df.max_a.values)
-    int_a_ecdf = interpolate.interp1d(srt_accs, acc_ecdf)
+    # Construct ECDF tables for players (pooled and by role), and save them
+    # for later use.
+    with report.stage('ecdf') as stage:
+        tables = ECDFTables.build(sum_df, metrics=['max_s', 'max_a'])
+        tables.save(f'{SDIR}ecdf_tables.npz')
+        stage.process(len(sum_df))
 
     # Load in set of summary statistics for players involved in concussions.
     inj_df = pd.read_csv(SDIR.split('data/')[0]+'data/spd_acc_summary.csv')
@@ -185,14 +182,8 @@ if __name__ == '__main__':
     inj_df.loc[:, 'max_move_s'] = inj_df.apply(_moving_play_s, args=('s'), axis=1)
     inj_df.loc[:, 'max_move_a'] = inj_df.apply(_moving_play_s, args=('a'), axis=1)
 
-    def _get_s_cdf(x):
-        return int_s_ecdf(x)
-
-    def _get_a_cdf(x):
-        return int_a_ecdf(x)
-
-    inj_df.loc[:, 's_cumprob'] = inj_df.max_play_s.apply(_get_s_cdf)
-    inj_df.loc[:, 'a_cumprob'] = inj_df.max_play_a.apply(_get_a_cdf)
+    inj_df.loc[:, 's_cumprob'] = tables.lookup('max_s', inj_df.max_play_s.values)
+    inj_df.loc[:, 'a_cumprob'] = tables.lookup('max_a', inj_df.max_play_a.values)
 
     """
     # Make figure (histogram), then plot.
@@ -204,9 +195,7 @@ if __name__ == '__main__':
     """
 
     # Make figure (acceleration ECDF), then plot.
-    a_vals = np.linspace(min(srt_accs), max(srt_accs),200)
-    a_ecdf = np.array([int_a_ecdf(x) for x in a_vals])
-    a_ecdf = np.vstack([a_vals,a_ecdf]).T
+    a_ecdf = tables.curve('max_a')
 
     inj_a_data = inj_df.loc[:, ['max_move_a', 'a_cumprob']].values
 
@@ -215,12 +204,12 @@ if __name__ == '__main__':
     pio.write_image(figure, f'{ODIR}acc-ecdf-mov.pdf')
 
     # Make figure (speed ECDF), then plot.
-    s_vals = np.linspace(min(srt_spds), max(srt_spds),200)
-    s_ecdf = np.array([int_s_ecdf(x) for x in s_vals])
-    s_ecdf = np.vstack([s_vals,s_ecdf]).T
+    s_ecdf = tables.curve('max_s')
 
     inj_s_data = inj_df.loc[:, ['max_move_s', 's_cumprob']].values
 
     figure = plot_ecdf(s_ecdf, inj_s_data, 10)
     #iplot(figure, filename='spd-ecdf')
     pio.write_image(figure, f'{ODIR}spd-ecdf-mov.pdf')
+
+    report.write()
@@ -9,80 +9,206 @@
 ## IMPORTS
 import os
 import glob
+import numpy as np
 import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor
+
+import event_timeline
+import key_index
+import ngs_schema
+import preprocess_small_data
+import role_sketches
+from event_timeline import (WINDOW_EVENTS, EventTimeline, build_event_timeline,
+                            find_event_timeline, play_window, player_events,
+                            timeline_is_current, timeline_path, window_bounds)
+from instrument import RunReport
+from key_index import KeyIndex
+from manifest import Manifest, code_version
+from ngs_schema import _group_starts, read_ngs_csv
+from ngs_store import list_partitions, read_ngs
 from preprocess_small_data import load_data
+from role_sketches import RoleSketches
+from trajectory_store import TrajectoryStore
 
 ## VARIABLES
 DDIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/data/wdynamics/'
 ODIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/data/sumdynamics/'
+TDIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/data/trajectories/'
+# Punt roles (the file load_data reads them from).
+ROLE_FILE = f"{preprocess_small_data.WDIR}{preprocess_small_data.SOURCE_FILES['play_role']}"
 REL_COLS = ['Season_Year', 'GameKey', 'PlayID', 'GSISID']
+USE_STORE = False # read from columnar store (see ngs_store.py) instead of CSVs
+USE_TRAJ_STORE = False # read players from trajectory store (see trajectory_store.py)
+N_SHARD_WORKERS = None # split each file by GameKey across this many processes (None: don't)
+YD_TO_M = 0.9144 # multiplicative factor for converting yards to meters
+MAX_COLS = ['vx', 'vy', 's', 'ax', 'ay', 'a']
+
+# Extra summary statistics (see summarize_windows).
+SUMMARY_OPTS = {
+    'percentiles': [], # e.g., [0.5, 0.9] -> p50_s, p90_s, ...
+    'time_of_max': False, # t_max_s, t_max_a
+    'mean_s': False,
+    'distance': False
+}
 
 ## FUNCTIONS
-def extract_summary_statistics(ngs_df):
+def first_event_frames(ngs_df, key_cols=REL_COLS, timeline=None):
+    """
+    Find the frame (row offset within each player/play) of the first
+    occurrence of each event in WINDOW_EVENTS, for every player/play at once.
+    Missing events get a -1.
+
+    Parameters:
+        ngs_df: pd.DataFrame
+            NGS data, sorted by key_cols (and time within each player/play).
+        key_cols: list (str) (default REL_COLS)
+            Columns defining a player/play.
+        timeline: EventTimeline (default None)
+            Saved event timeline for ngs_df (built from ngs_df if not given).
+    """
+
+    key_cols = list(key_cols)
+    starts = np.flatnonzero(_group_starts(ngs_df, key_cols))
+
+    frames_df = ngs_df.iloc[starts].loc[:, key_cols].reset_index(drop=True)
+    frames_df['row_start'] = starts
+    frames_df['n_frames'] = np.diff(np.append(starts, len(ngs_df)))
+
+    if timeline is None:
+        tl_df = build_event_timeline(ngs_df, key_cols)
+    else:
+        tl_df = timeline.timeline
+
+    # Position of each timeline row's player/play in frames_df.
+    if key_cols:
+        grp = pd.MultiIndex.from_frame(frames_df.loc[:, key_cols]).get_indexer(
+            pd.MultiIndex.from_frame(tl_df.loc[:, key_cols]))
+    else:
+        grp = np.zeros(len(tl_df), dtype=np.int64)
+
+    for event in WINDOW_EVENTS:
+        rows = np.flatnonzero((tl_df.Event.values == event) & (grp >= 0))
+        first = np.full(len(frames_df), -1, dtype=np.int64)
+        first[grp[rows]] = tl_df.frame.values[rows]
+        frames_df[event] = first
+
+    return frames_df
+
+def event_windows(ngs_df, key_cols=REL_COLS, timeline=None):
+    """
+    Work out the relevant stretch of each player/play (see window_bounds) for
+    every player/play at once. Returns one row per player/play with the row
+    range [start, stop) in ngs_df and a flag for plays that ended in a fair
+    catch.
+
+    Parameters:
+        ngs_df: pd.DataFrame
+            NGS data, sorted by key_cols (and time within each player/play).
+        key_cols: list (str) (default REL_COLS)
+            Columns defining a player/play.
+        timeline: EventTimeline (default None)
+            Saved event timeline for ngs_df (built from ngs_df if not given).
+    """
+
+    win_df = first_event_frames(ngs_df, key_cols, timeline=timeline)
+    play_st, play_ei = window_bounds(win_df, win_df.n_frames.values)
+
+    win_df['start'] = win_df.row_start + play_st
+    win_df['stop'] = win_df.row_start + play_ei
+    win_df['fair_catch'] = win_df.fair_catch >= 0
+
+    return win_df.loc[:, list(key_cols) + ['start', 'stop', 'fair_catch']]
+
+def summarize_windows(ngs_df, win_df, percentiles=(), time_of_max=False,
+                      mean_s=False, distance=False):
     """
-    Given a player's NGS data, extract a few summary statistics. We're really
-    only interesting in speeds/accelerations here.
+    Compute summary statistics for every player/play window in a file in one
+    pass. We're really only interested in speeds/accelerations here: besides
+    the maximum of each component (vx, vy, s, ax, ay, a, in meters), a few
+    optional statistics can be added:
+    percentiles of each component, time of the maximum speed/acceleration
+    (since the start of the window, i.e. the punt where there is one), mean
+    speed, and distance covered.
+
+    Returns the summary table along with the number of player/plays skipped
+    for each reason (fair catch, empty window).
 
     Parameters:
         ngs_df: pd.DataFrame
-            NGS data for a single player/play. Note that this should only contain
-            data relevant to the punt/subsequent motion.
+            NGS data (with roles), sorted by player/play and time.
+        win_df: pd.DataFrame
+            Windows for each player/play (see event_windows).
+        percentiles: list (float) (default ())
+            Percentiles to compute (as fractions).
+        time_of_max: bool (default False)
+            Boolean indicating whether to include the time of maximum
+            speed/acceleration.
+        mean_s: bool (default False)
+            Boolean indicating whether to include mean speed.
+        distance: bool (default False)
+            Boolean indicating whether to include distance covered.
     """
 
-    sum_dict = {}
-    YD_TO_M = 0.9144 # multiplicative factor for converting yards to meters
+    lengths = (win_df.stop - win_df.start).values
+    skips = {
+        'fair_catch': int(win_df.fair_catch.sum()),
+        'empty_window': int(((lengths == 0) & ~win_df.fair_catch.values).sum())
+    }
+
+    win_df = win_df.loc[~win_df.fair_catch.values & (lengths > 0)].reset_index(drop=True)
+    lengths = (win_df.stop - win_df.start).values
+
+    # Rows in each window, labeled by window.
+    rows = np.repeat(win_df.start.values - np.cumsum(np.append(0, lengths[:-1])), lengths)
+    rows += np.arange(len(rows))
+    label = np.repeat(np.arange(len(win_df)), lengths)
+
+    play_df = ngs_df.iloc[rows].reset_index(drop=True)
+    grouped = play_df.groupby(label, sort=False)
+
+    stats_df = win_df.loc[:, REL_COLS].copy()
+    stats_df['Role'] = grouped.Role.first().astype(object).values
+
+    for col in MAX_COLS:
+        stats_df[f'max_{col}'] = grouped[col].max().values*YD_TO_M
 
-    sum_dict['Season_Year'] = ngs_df.Season_Year.values[0]
-    sum_dict['GameKey'] = ngs_df.GameKey.values[0]
-    sum_dict['PlayID'] = ngs_df.PlayID.values[0]
-    sum_dict['GSISID'] = ngs_df.GSISID.values[0]
-    sum_dict['Role'] = ngs_df.Role.tolist()[0]
+    for q in percentiles:
+        quant = grouped[MAX_COLS].quantile(q)
+        for col in MAX_COLS:
+            stats_df[f'p{int(round(q*100))}_{col}'] = quant[col].values*YD_TO_M
 
-    sum_dict['max_vx'] = ngs_df.vx.max()*YD_TO_M
-    sum_dict['max_vy'] = ngs_df.vy.max()*YD_TO_M
-    sum_dict['max_s'] = ngs_df.s.max()*YD_TO_M
-    sum_dict['max_ax'] = ngs_df.ax.max()*YD_TO_M
-    sum_dict['max_ay'] = ngs_df.ay.max()*YD_TO_M
-    sum_dict['max_a'] = ngs_df.a.max()*YD_TO_M
+    if time_of_max:
+        t_rel = play_df.t.values - np.repeat(grouped.t.first().values, lengths)
+        for col in ['s', 'a']:
+            vals = play_df[col].values
+            at_max = np.flatnonzero(vals == grouped[col].transform('max').values)
+            grps, idx = np.unique(label[at_max], return_index=True)
 
-    return sum_dict
+            t_max = np.full(len(win_df), np.nan)
+            t_max[grps] = t_rel[at_max[idx]]
+            stats_df[f't_max_{col}'] = t_max
 
+    if mean_s:
+        stats_df['mean_s'] = grouped.s.mean().values*YD_TO_M
+
+    if distance:
+        stats_df['distance'] = grouped.dis.sum().values*YD_TO_M
+
+    return stats_df, skips
 
 def strip_ngs_data(ngs_df):
     """
     Given a set of NGS data for a player/play, strip out all of the data that's
-    not relevant (motion before snap/after whistle).
+    not relevant (motion before snap/after whistle). See event_windows for
+    doing this for every player/play at once.
 
     Parameters:
         ngs_df: pd.DataFrame
             NGS data for a single player/play.
     """
 
-    # Figure out where the ball snap occurred and get the index so that we can
-    # discard all data prior to that instant.
-    try:
-        play_st = ngs_df.loc[ngs_df.Event == 'punt'].index[0]
-    except IndexError:
-        try:
-            play_st = ngs_df.loc[ngs_df.Event == 'ball_snap'].index[0]
-        except IndexError:
-            play_st = ngs_df.index.min()
-
-    # Figure out where the play "ended" so that we can discard all data after
-    # that. For simplicity, we assume that any concussion event would have occured
-    # prior to a penalty flag being thrown or within five seconds of a tackle.
-    try:
-        play_ei = ngs_df.loc[ngs_df.Event == 'penalty_flag'].index[0]
-    except IndexError:
-        try:
-            play_ei = ngs_df.loc[ngs_df.Event == 'tackle'].index[0] + 50
-            play_ps = ngs_df.loc[ngs_df.Event == 'play_submit'].index[0]
-
-            while play_ei > play_ps:
-                play_ei -= 10
-        except IndexError:
-            play_ei = ngs_df.index.max()
+    play_st, play_ei = play_window(player_events(ngs_df), len(ngs_df))
 
     # Slice out the data that we actually need.
     play_df = ngs_df.iloc[play_st:play_ei]
@@ -91,6 +217,109 @@ def strip_ngs_data(ngs_df):
     return play_df
 
 
+def summarize_player_plays(ngs_data, punt_role, timeline=None):
+    """
+    Attach punt roles to a set of NGS data, then work out the relevant stretch
+    of every player/play and summarize them (see event_windows and
+    summarize_windows).
+
+    Parameters:
+        ngs_data: pd.DataFrame
+            NGS data (with dynamics).
+        punt_role: pd.DataFrame
+            Punt roles (from load_data()).
+        timeline: EventTimeline (default None)
+            Saved event timeline for ngs_data.
+    """
+
+    # Stick player roles onto NGS data.
+    ngs_data = ngs_data.merge(punt_role, how='inner', left_on=REL_COLS, right_on=REL_COLS)
+
+    player_index = KeyIndex(ngs_data, REL_COLS, sort_cols=['t'])
+    win_df = event_windows(player_index.data, timeline=timeline)
+
+    return summarize_windows(player_index.data, win_df, **SUMMARY_OPTS)
+
+def shard_by_gamekey(ngs_data, n_shards):
+    """
+    Split a set of NGS data into (up to) n_shards pieces by ranges of GameKey,
+    with roughly the same number of rows in each. Shards come back in GameKey
+    order.
+
+    Parameters:
+        ngs_data: pd.DataFrame
+            NGS data.
+        n_shards: int
+            Number of shards.
+    """
+
+    if not len(ngs_data):
+        return [ngs_data]
+
+    # Sort by GameKey once, so each shard is a contiguous slice.
+    ngs_data = ngs_data.sort_values('GameKey', kind='mergesort')
+    game_keys = ngs_data.GameKey.to_numpy(dtype=float, na_value=np.nan)
+
+    games = ngs_data.GameKey.value_counts().sort_index()
+    cum_rows = np.cumsum(games.values)
+
+    # Last game in each shard.
+    cuts = np.searchsorted(cum_rows, np.arange(1, n_shards) * cum_rows[-1] / n_shards)
+    bounds = np.unique(np.append(games.index.values[cuts], games.index.values[-1]))
+
+    # Rows without a GameKey sort last and fall past the final stop.
+    stops = np.searchsorted(game_keys, bounds, side='right')
+    starts = np.append(0, stops[:-1])
+
+    return [ngs_data.iloc[a:b] for a, b in zip(starts, stops)]
+
+_PUNT_ROLE = None # punt roles for shard workers (see _init_shard_worker)
+
+def _init_shard_worker(punt_role):
+    # Roles are sent to each worker once, rather than with every shard.
+    global _PUNT_ROLE
+    _PUNT_ROLE = punt_role
+
+def _summarize_shard(shard_df, tl_df):
+    timeline = EventTimeline(tl_df) if tl_df is not None else None
+
+    return summarize_player_plays(shard_df, _PUNT_ROLE, timeline=timeline)
+
+def summarize_sharded(ngs_data, punt_role, n_workers, timeline=None):
+    """
+    Parallel version of summarize_player_plays: the data are split by GameKey
+    (see shard_by_gamekey) and each shard is summarized in its own process.
+    The result is the same as summarizing everything at once.
+
+    Parameters:
+        ngs_data: pd.DataFrame
+            NGS data (with dynamics).
+        punt_role: pd.DataFrame
+            Punt roles (from load_data()).
+        n_workers: int
+            Number of worker processes (and shards).
+        timeline: EventTimeline (default None)
+            Saved event timeline for ngs_data.
+    """
+
+    shards = shard_by_gamekey(ngs_data, n_workers)
+
+    if timeline is not None:
+        tl_games = timeline.timeline.GameKey.values
+        tl_shards = [timeline.timeline.loc[np.isin(tl_games, x.GameKey.unique())]
+                     for x in shards]
+    else:
+        tl_shards = [None]*len(shards)
+
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_shard_worker,
+                             initargs=(punt_role,)) as pool:
+        results = list(pool.map(_summarize_shard, shards, tl_shards))
+
+    stats_df = pd.concat([x[0] for x in results], ignore_index=True)
+    skips = {reason: sum(x[1][reason] for x in results) for reason in results[0][1]}
+
+    return stats_df, skips
+
 
 ## MAIN
 if __name__ == '__main__':
@@ -102,39 +331,91 @@ if __name__ == '__main__':
 
     # Load smallest set of data for processing.
     #FILE = 'NGS-2017-post.csv'
-    files = glob.glob(f'{DDIR}*.csv')
+    if USE_STORE:
+        files = [f'NGS-{sy}-{st.lower()}.csv' for sy, st in list_partitions()]
+    else:
+        files = glob.glob(f'{DDIR}*.csv')
+
+    # Keep track of what's been built so that we only redo files that have
+    # changed (only when reading straight from the CSVs).
+    manifest = Manifest(f'{ODIR}manifest.json')
+    code = code_version(__file__, ngs_schema.__file__, event_timeline.__file__,
+                        key_index.__file__, preprocess_small_data.__file__,
+                        role_sketches.__file__)
+    track = not (USE_STORE or USE_TRAJ_STORE)
+
+    # Per-role quantile sketches of the summary statistics are kept for each
+    # file (so that skipped files still count) and merged at the end.
+    os.makedirs(f'{ODIR}sketches', exist_ok=True)
+    sketches = RoleSketches()
+
+    # Keep track of where the time goes (see instrument.py).
+    report = RunReport('collect_ngs_dynamics_data')
 
     for file in files:
-        ngs_data = pd.read_csv(file)
+        OFILE = os.path.basename(file).split('.csv')[0]+'-summary.csv'
+        KFILE = f'{ODIR}sketches/' + os.path.basename(file).split('.csv')[0]+'.json'
+        io_files = ([file, ROLE_FILE], [f'{ODIR}{OFILE}', KFILE])
 
-        # Stick player roles onto NGS data.
-        ngs_data = ngs_data.merge(punt_role, how='inner', left_on=REL_COLS, right_on=REL_COLS)
+        # Use the saved event timeline if it's up to date (it then counts as
+        # an input, so summaries are rebuilt whenever it changes).
+        ngs_file = f'{DDIR}{os.path.basename(file)}'
+        use_timeline = timeline_is_current(ngs_file)
+        if use_timeline:
+            io_files[0].append(timeline_path(ngs_file))
 
-        # Do a bumch of preprocessing to make our lives easier.
-        player_df = ngs_data.drop_duplicates(REL_COLS).reset_index(drop=True)
-        player_df = player_df.loc[:, REL_COLS]
-        player_df.loc[:, 'playerIndex'] = player_df.index.values
-        ngs_data = ngs_data.merge(player_df, how='inner', left_on=REL_COLS, right_on=REL_COLS)
+        if track and manifest.is_current('collect_ngs_dynamics_data', *io_files,
+                                         params=SUMMARY_OPTS, code=code):
+            print(f'{OFILE}: up to date')
+            report['files'].skip('up_to_date')
+            sketches.merge(RoleSketches.load(KFILE))
+            continue
 
-        # Step through all players.
-        ss_list = []
+        with report.stage('load') as stage:
+            if USE_TRAJ_STORE:
+                store = TrajectoryStore(TDIR + os.path.basename(file).split('.csv')[0])
+                ngs_data = store.to_frame()
+            elif USE_STORE:
+                sy, st = os.path.basename(file).split('.csv')[0].split('-')[1:]
+                ngs_data = read_ngs(season_year=int(sy), season_type=st.capitalize())
+                ngs_data.drop('Season_Type', axis=1, inplace=True)
+            else:
+                ngs_data = read_ngs_csv(file)
 
-        for play_idx in range(ngs_data.playerIndex.max()):
-            play_df = ngs_data.loc[ngs_data.playerIndex == play_idx].reset_index(drop=True)
+            stage.rows(n_out=len(ngs_data))
 
-            if 'fair_catch' in play_df.Event.unique():
-                continue
+            timeline = find_event_timeline(ngs_file) if use_timeline else None
+
+        # Work out the relevant stretch of every player/play and summarize them
+        # all in one go (split by GameKey across processes, if requested).
+        with report.stage('summarize') as stage:
+            if N_SHARD_WORKERS:
+                stats_df, skips = summarize_sharded(ngs_data, punt_role, N_SHARD_WORKERS,
+                                                    timeline=timeline)
             else:
-                pass
+                stats_df, skips = summarize_player_plays(ngs_data, punt_role,
+                                                         timeline=timeline)
+            print(f'{OFILE}: {len(stats_df)} player/plays, skipped {skips}')
 
-            strip_play = strip_ngs_data(play_df)
-            try:
-                sumstats = extract_summary_statistics(strip_play)
-                ss_list.append(sumstats)
-            except:
-                continue
+            stage.rows(n_in=len(ngs_data), n_out=len(stats_df))
+            stage.process(len(stats_df))
+            for reason, n_skip in skips.items():
+                stage.skip(reason, n_skip)
 
-        # Stick in a DataFrame, save.
-        OFILE = os.path.basename(file).split('.csv')[0]+'-summary.csv'
-        stats_df = pd.DataFrame(ss_list)
-        stats_df.to_csv(f'{ODIR}{OFILE}', index=False)
+        # Save.
+        with report.stage('save'):
+            stats_df.to_csv(f'{ODIR}{OFILE}', index=False)
+
+            file_sketches = RoleSketches().update(stats_df)
+            file_sketches.save(KFILE)
+            sketches.merge(file_sketches)
+
+            if track:
+                manifest.record('collect_ngs_dynamics_data', *io_files,
+                                params=SUMMARY_OPTS, code=code)
+
+        report['files'].process()
+
+    # League-wide sketches (see role_sketches.py).
+    sketches.save(f'{ODIR}role_sketches.json')
+    report.write()
@@ -0,0 +1,172 @@
+#
+# ECDF lookup tables for the summary dynamics. Instead of keeping every max
+# speed/acceleration around (and interpolating the full ECDF one value at a
+# time), each Role/metric gets a fixed-resolution table of values at evenly
+# spaced cumulative probabilities. Percentile ranks for any number of players
+# are then one searchsorted call per role.
+#
+# Author: Charlie Bonfield
+# Last Modified: 1/2019
+
+## IMPORTS
+import numpy as np
+import pandas as pd
+
+## VARIABLES
+ALL_ROLES = 'ALL' # key for the table pooled over every role
+N_POINTS = 1001 # resolution of each table
+
+## FUNCTIONS
+class ECDFTables:
+    """
+    Per-Role ECDF tables for a set of summary metrics (see build()). Each
+    table holds the values at cumulative probabilities 0, 1/(N-1), ..., 1.
+
+    Parameters:
+        tables: dict (keys: (role, metric), values: np.array)
+            Values at each cumulative probability.
+        counts: dict (keys: (role, metric), values: int)
+            Number of values each table was built from.
+    """
+
+    def __init__(self, tables, counts=None):
+
+        self.tables = tables
+        self.counts = counts or {}
+
+    @classmethod
+    def build(cls, sum_df, metrics=('max_s', 'max_a'), n_points=N_POINTS,
+              role_col='Role'):
+        """
+        Build tables from a set of summary statistics (one table per role and
+        metric, plus one pooled over all roles).
+
+        Parameters:
+            sum_df: pd.DataFrame
+                Summary statistics (see collect_ngs_dynamics_data.py).
+            metrics: list (str) (default ('max_s', 'max_a'))
+                Metrics to build tables for.
+            n_points: int (default N_POINTS)
+                Number of points in each table.
+            role_col: str (default 'Role')
+                Column holding punt roles (None to only build pooled tables).
+        """
+
+        probs = np.linspace(0., 1., n_points)
+        groups = [(ALL_ROLES, sum_df)]
+        if role_col is not None:
+            groups += list(sum_df.groupby(role_col, sort=True))
+
+        tables, counts = {}, {}
+
+        for role, role_df in groups:
+            for metric in metrics:
+                vals = role_df[metric].dropna().values
+                if len(vals):
+                    tables[(role, metric)] = np.quantile(vals, probs)
+                    counts[(role, metric)] = len(vals)
+
+        return cls(tables, counts)
+
+    def lookup(self, metric, values, roles=None):
+        """
+        Percentile rank (ECDF) of a set of values, conditioned on role. Values
+        outside a table's range get 0 or 1; unknown roles get nan.
+
+        Parameters:
+            metric: str
+                Summary metric (e.g., max_s).
+            values: np.array
+                Values to rank.
+            roles: np.array (str) (default None)
+                Role for each value (None uses the pooled table for all).
+        """
+
+        values = np.asarray(values, dtype=float)
+        out = np.full(len(values), np.nan)
+
+        if roles is None:
+            roles = np.full(len(values), ALL_ROLES, dtype=object)
+        roles = np.asarray(roles, dtype=object)
+
+        for role in pd.unique(roles):
+            table = self.tables.get((role, metric))
+            if table is None:
+                continue
+
+            rows = np.flatnonzero(roles == role)
+            out[rows] = self._rank(table, values[rows])
+
+        return out
+
+    @staticmethod
+    def _rank(table, values):
+        probs = np.linspace(0., 1., len(table))
+
+        # Interpolate between the table entries on either side of each value
+        # (ties in the table - e.g. lots of identical values - take the
+        # highest probability, as with an ECDF).
+        hi = np.clip(np.searchsorted(table, values, side='right'), 1, len(table)-1)
+        lo = hi - 1
+        width = table[hi] - table[lo]
+        frac = np.where(width > 0, (values - table[lo]) / np.where(width > 0, width, 1.), 1.)
+        ranks = probs[lo] + np.clip(frac, 0., 1.) * (probs[hi] - probs[lo])
+
+        ranks[values < table[0]] = 0.
+        ranks[values >= table[-1]] = 1.
+        ranks[np.isnan(values)] = np.nan
+
+        return ranks
+
+    def curve(self, metric, role=ALL_ROLES):
+        """
+        ECDF for a role/metric as an array of [value, ECDF(value)] (e.g., for
+        plotting).
+
+        Parameters:
+            metric: str
+                Summary metric (e.g., max_s).
+            role: str (default ALL_ROLES)
+                Punt role.
+        """
+
+        table = self.tables[(role, metric)]
+
+        return np.vstack([table, np.linspace(0., 1., len(table))]).T
+
+    def save(self, path):
+        """
+        Save tables (.npz).
+
+        Parameters:
+            path: str
+                Path to file.
+        """
+
+        arrays = {f'{role}|{metric}': table for (role, metric), table in self.tables.items()}
+        arrays.update({f'n|{role}|{metric}': np.array(n) for (role, metric), n in self.counts.items()})
+
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load tables saved with save().
+
+        Parameters:
+            path: str
+                Path to file.
+        """
+
+        tables, counts = {}, {}
+
+        with np.load(path, allow_pickle=False) as data:
+            for name in data.files:
+                parts = name.split('|')
+                if parts[0] == 'n':
+                    counts[tuple(parts[1:])] = int(data[name])
+                else:
+                    tables[tuple(parts)] = data[name]
+
+        return cls(tables, counts)
+
@@ -0,0 +1,346 @@
+#
+# Event timelines for NGS data. For every player/play we record the frame
+# (row offset within the player's trajectory, in time order) and time of the
+# first occurrence of each event (ball_snap, punt, tackle, ...). Timelines are
+# built once and saved next to the NGS data (in an events/ directory), so the
+# windowing code can look up when the play started/ended without scanning the
+# Event column over and over.
+#
+# Author: Charlie Bonfield
+# Last Modified: 1/2019
+
+## IMPORTS
+import os
+import glob
+import numpy as np
+import pandas as pd
+
+from ngs_schema import _group_starts, read_ngs_csv
+
+## VARIABLES
+DDIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/data/'
+
+PLAYER_COLS = ['Season_Year', 'GameKey', 'PlayID', 'GSISID']
+WINDOW_EVENTS = ['punt', 'ball_snap', 'penalty_flag', 'tackle', 'play_submit', 'fair_catch']
+
+## FUNCTIONS
+def build_event_timeline(ngs_df, key_cols=PLAYER_COLS):
+    """
+    Build the event timeline for a set of NGS data: one row per (player/play,
+    event) with the frame, relative time (t), and timestamp (Time) of the
+    first occurrence of that event.
+
+    Parameters:
+        ngs_df: pd.DataFrame
+            NGS data, sorted by key_cols (and time within each player/play).
+        key_cols: list (str) (default PLAYER_COLS)
+            Columns defining a player/play.
+    """
+
+    key_cols = list(key_cols)
+    new_grp = _group_starts(ngs_df, key_cols)
+    starts = np.flatnonzero(new_grp)
+    grp = np.cumsum(new_grp) - 1
+    pos = np.arange(len(ngs_df)) - starts[grp] if len(ngs_df) else grp
+
+    # First row for each (group, event) - rows are in order, so np.unique
+    # picks out first occurrences.
+    codes, events = pd.factorize(ngs_df.Event.astype(object))
+    rows = np.flatnonzero(codes >= 0)
+    _, idx = np.unique(grp[rows]*max(len(events), 1) + codes[rows], return_index=True)
+    rows = np.sort(rows[idx])
+
+    extra_cols = [x for x in ['t', 'Time'] if x in ngs_df.columns]
+    timeline = ngs_df.iloc[rows].loc[:, key_cols + extra_cols].reset_index(drop=True)
+    timeline.insert(len(key_cols), 'Event', np.asarray(events, dtype=object)[codes[rows]])
+    timeline.insert(len(key_cols)+1, 'frame', pos[rows])
+
+    return timeline
+
+def timeline_path(ngs_file):
+    """
+    Path of the event timeline for an NGS dataset (events/ directory next to
+    the dataset, same file name).
+
+    Parameters:
+        ngs_file: str
+            Path to NGS dataset (CSV).
+    """
+
+    return os.path.join(os.path.dirname(ngs_file), 'events', os.path.basename(ngs_file))
+
+def sorted_event_timeline(ngs_df):
+    """
+    Build the event timeline for a set of NGS data in any row order (rows are
+    put in time order within each player/play first).
+
+    Parameters:
+        ngs_df: pd.DataFrame
+            NGS data (whole player/plays only).
+    """
+
+    ngs_df = ngs_df.sort_values(PLAYER_COLS + ['t'], kind='mergesort')
+
+    return build_event_timeline(ngs_df)
+
+def write_event_timeline(ngs_file, ngs_df=None, out_file=None):
+    """
+    Build the event timeline for an NGS dataset and save it (see
+    timeline_path). The timeline is written to a temporary file first and
+    then moved into place.
+
+    Parameters:
+        ngs_file: str
+            Path to NGS dataset (CSV).
+        ngs_df: pd.DataFrame (default None)
+            Contents of ngs_file, if already loaded.
+        out_file: str (default None)
+            Path of output file (None uses timeline_path(ngs_file)).
+    """
+
+    if ngs_df is None:
+        ngs_df = read_ngs_csv(ngs_file)
+
+    timeline = sorted_event_timeline(ngs_df)
+
+    out_file = out_file or timeline_path(ngs_file)
+    tmp_file = os.path.join(os.path.dirname(out_file), f'.{os.path.basename(out_file)}.tmp')
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    timeline.to_csv(tmp_file, index=False)
+    os.replace(tmp_file, out_file)
+
+    return timeline
+
+def timeline_is_current(ngs_file):
+    """
+    Check whether an NGS dataset has a saved event timeline that is no older
+    than the dataset itself (a timeline left over from an earlier version of
+    the dataset doesn't count).
+
+    Parameters:
+        ngs_file: str
+            Path to NGS dataset (CSV).
+    """
+
+    tl_file = timeline_path(ngs_file)
+
+    if not os.path.exists(tl_file):
+        return False
+    if not os.path.exists(ngs_file):
+        return True
+
+    return os.path.getmtime(tl_file) >= os.path.getmtime(ngs_file)
+
+def read_event_timeline(ngs_file):
+    """
+    Load the event timeline for an NGS dataset (see write_event_timeline).
+
+    Parameters:
+        ngs_file: str
+            Path to NGS dataset (CSV).
+    """
+
+    return EventTimeline(pd.read_csv(timeline_path(ngs_file)))
+
+def find_event_timeline(ngs_file):
+    """
+    Load the event timeline for an NGS dataset if it's up to date (see
+    timeline_is_current), otherwise return None.
+
+    Parameters:
+        ngs_file: str
+            Path to NGS dataset (CSV).
+    """
+
+    if not timeline_is_current(ngs_file):
+        return None
+
+    return read_event_timeline(ngs_file)
+
+def _clip_window(play_st, play_ei, n_frames):
+    # Same result as slicing with iloc[play_st:play_ei] (negative ends count
+    # back from the end of the trajectory), as [start, stop) with start <= stop.
+    play_st = np.minimum(play_st, n_frames)
+    play_ei = np.clip(np.where(play_ei < 0, n_frames + play_ei, play_ei), 0, n_frames)
+
+    return play_st, np.maximum(play_ei, play_st)
+
+def _step_back(tackle, submit):
+    # Five seconds after the tackle, stepped back in one second increments
+    # until it's no later than play_submit.
+    return tackle + 50 - 10*np.maximum(0, -((submit - tackle - 50) // 10))
+
+def window_bounds(frames, n_frames):
+    """
+    Work out the relevant stretch (motion between the snap and the whistle)
+    of any number of player/plays at once, as [start, stop) frames.
+
+    The play starts at the punt (or the snap, or the first frame). It ends at
+    the first penalty flag or, failing that, five seconds after the tackle
+    (stepped back in one second increments until it's no later than
+    play_submit). If neither is available, the last frame is dropped.
+
+    Parameters:
+        frames: dict or pd.DataFrame
+            First frame of each event in WINDOW_EVENTS (arrays, -1 if missing).
+        n_frames: np.array (int)
+            Number of frames for each player/play.
+    """
+
+    punt, snap = np.asarray(frames['punt']), np.asarray(frames['ball_snap'])
+    flag = np.asarray(frames['penalty_flag'])
+    tackle, submit = np.asarray(frames['tackle']), np.asarray(frames['play_submit'])
+    n_frames = np.asarray(n_frames)
+
+    play_st = np.where(punt >= 0, punt, np.where(snap >= 0, snap, 0))
+    play_ei = np.where(flag >= 0, flag,
+                       np.where((tackle >= 0) & (submit >= 0),
+                                _step_back(tackle, submit), n_frames - 1))
+
+    return _clip_window(play_st, play_ei, n_frames)
+
+def play_window(frames, n_frames):
+    """
+    Relevant stretch of a single player/play (see window_bounds).
+
+    Parameters:
+        frames: dict (keys: events, values: frames)
+            First frame of each event (see EventTimeline.frames).
+        n_frames: int
+            Number of frames.
+    """
+
+    arrs = {x: np.array([frames.get(x, -1)]) for x in WINDOW_EVENTS}
+    play_st, play_ei = window_bounds(arrs, np.array([n_frames]))
+
+    return int(play_st[0]), int(play_ei[0])
+
+def pair_window(play_frames, part_frames, n_play, n_part):
+    """
+    Relevant stretch of a player/partner pair (see window_bounds). The pair
+    only starts at the punt (or the snap) if both have that event, and only
+    ends after the tackle if both have a tackle and play_submit. A penalty
+    flag on the player ends the play for both of them.
+
+    Parameters:
+        play_frames: dict (keys: events, values: frames)
+            First frame of each event for the player.
+        part_frames: dict (keys: events, values: frames)
+            First frame of each event for the partner.
+        n_play: int
+            Number of frames for player.
+        n_part: int
+            Number of frames for partner.
+    """
+
+    def _both(event):
+        return event in play_frames and event in part_frames
+
+    if _both('punt'):
+        play_st, part_st = play_frames['punt'], part_frames['punt']
+    elif _both('ball_snap'):
+        play_st, part_st = play_frames['ball_snap'], part_frames['ball_snap']
+    else:
+        play_st, part_st = 0, 0
+
+    if 'penalty_flag' in play_frames:
+        play_ei = part_ei = play_frames['penalty_flag']
+    elif _both('tackle') and _both('play_submit'):
+        play_ei = _step_back(play_frames['tackle'], play_frames['play_submit'])
+        part_ei = _step_back(part_frames['tackle'], part_frames['play_submit'])
+    else:
+        play_ei, part_ei = n_play - 1, n_part - 1
+
+    play_win = _clip_window(play_st, play_ei, n_play)
+    part_win = _clip_window(part_st, part_ei, n_part)
+
+    return tuple(int(x) for x in play_win), tuple(int(x) for x in part_win)
+
+def player_events(ngs_df, timeline=None):
+    """
+    First frame of each event for a single player/play (frames count from the
+    first row of ngs_df). Looked up in the timeline if one is given, otherwise
+    worked out from ngs_df itself.
+
+    Parameters:
+        ngs_df: pd.DataFrame
+            NGS data for a single player/play (in time order).
+        timeline: EventTimeline (default None)
+            Event timeline covering this player/play.
+    """
+
+    if not len(ngs_df):
+        return {}
+
+    if timeline is not None:
+        return timeline.frames(ngs_df.iloc[0].loc[timeline.key_cols].tolist())
+
+    return EventTimeline(build_event_timeline(ngs_df, key_cols=[]), key_cols=[]).frames(())
+
+class EventTimeline:
+    """
+    Lookup table built from an event timeline (see build_event_timeline),
+    mapping each player/play to the first frame of each of its events.
+
+    Parameters:
+        timeline: pd.DataFrame
+            Event timeline.
+        key_cols: list (str) (default PLAYER_COLS)
+            Columns defining a player/play.
+    """
+
+    def __init__(self, timeline, key_cols=PLAYER_COLS):
+
+        self.key_cols = list(key_cols)
+        self.timeline = timeline
+        self._frames = {}
+
+        keys = zip(*[timeline[x].tolist() for x in self.key_cols]) if self.key_cols \
+            else [()]*len(timeline)
+
+        for key, event, frame in zip(keys, timeline.Event.tolist(), timeline.frame.tolist()):
+            self._frames.setdefault(tuple(key), {})[event] = frame
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, key):
+        return tuple(key) in self._frames
+
+    def frames(self, key):
+        """
+        First frame of each event for a player/play (empty if the player/play
+        has no events).
+
+        Parameters:
+            key: tuple
+                Player/play key.
+        """
+
+        return self._frames.get(tuple(key), {})
+
+    def frame(self, key, event):
+        """
+        First frame of an event for a player/play (-1 if it never happened).
+
+        Parameters:
+            key: tuple
+                Player/play key.
+            event: str
+                Event name.
+        """
+
+        return self.frames(key).get(event, -1)
+
+
+## MAIN
+if __name__ == '__main__':
+
+    # Build timelines for each NGS dataset (with dynamics) and for the NGS
+    # data for the injury set.
+    files = sorted(glob.glob(f'{DDIR}wdynamics/*.csv'))
+    files.append(f'{DDIR}injury_ngs_data.csv')
+
+    for nfil in files:
+        print(os.path.basename(nfil))
+        write_event_timeline(nfil)
@@ -0,0 +1,195 @@
+#
+# Lightweight instrumentation for the processing scripts. Each script keeps a
+# RunReport with one entry per stage (wall/CPU time, rows in/out, and counts of
+# plays processed/skipped/failed, with reasons), and writes it out as JSON at
+# the end of the run. Timing a stage is two clock reads, so this can stay on.
+#
+# Author: Charlie Bonfield
+# Last Modified: 1/2019
+
+## IMPORTS
+import os
+import json
+import time
+
+from contextlib import contextmanager
+
+## VARIABLES
+RDIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/reports/'
+
+## FUNCTIONS
+class Stage:
+    """
+    Timings and counters for a single stage of a run. Times are summed over
+    every time the stage is entered. CPU time only covers the current process
+    (not worker processes).
+
+    Parameters:
+        name: str
+            Name of stage.
+    """
+
+    def __init__(self, name):
+
+        self.name = name
+        self.calls = 0
+        self.wall = 0.
+        self.cpu = 0.
+        self.rows_in = 0
+        self.rows_out = 0
+        self.processed = 0
+        self.skipped = {}
+        self.failed = {}
+
+    def rows(self, n_in=0, n_out=0):
+        """
+        Count rows going into/coming out of the stage.
+
+        Parameters:
+            n_in: int (default 0)
+                Number of rows in.
+            n_out: int (default 0)
+                Number of rows out.
+        """
+
+        self.rows_in += int(n_in)
+        self.rows_out += int(n_out)
+
+    def process(self, n=1):
+        """
+        Count plays (or player/plays, files, ...) that were processed.
+
+        Parameters:
+            n: int (default 1)
+                Number processed.
+        """
+
+        self.processed += int(n)
+
+    def skip(self, reason, n=1):
+        """
+        Count plays that were deliberately skipped.
+
+        Parameters:
+            reason: str
+                Reason for skipping (e.g., fair_catch).
+            n: int (default 1)
+                Number skipped.
+        """
+
+        self.skipped[reason] = self.skipped.get(reason, 0) + int(n)
+
+    def fail(self, reason, n=1):
+        """
+        Count plays that couldn't be processed (errors).
+
+        Parameters:
+            reason: str
+                Reason for failure (e.g., exception type).
+            n: int (default 1)
+                Number failed.
+        """
+
+        self.failed[reason] = self.failed.get(reason, 0) + int(n)
+
+    def to_dict(self):
+        return {
+            'name': self.name, 'calls': self.calls,
+            'wall_s': round(self.wall, 6), 'cpu_s': round(self.cpu, 6),
+            'rows_in': self.rows_in, 'rows_out': self.rows_out,
+            'processed': self.processed,
+            'skipped': dict(self.skipped), 'failed': dict(self.failed)
+        }
+
+class RunReport:
+    """
+    Collection of stages for a run of a script (see Stage).
+
+    Parameters:
+        name: str
+            Name of run (usually the script name).
+    """
+
+    def __init__(self, name):
+
+        self.name = name
+        self.started = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.stages = {}
+        self._wall0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+
+    def __getitem__(self, name):
+        if name not in self.stages:
+            self.stages[name] = Stage(name)
+
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a block of code as (part of) a stage. Yields the Stage, so that
+        counters can be updated inside the block.
+
+        Parameters:
+            name: str
+                Name of stage.
+        """
+
+        stage = self[name]
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+
+        try:
+            yield stage
+        finally:
+            stage.wall += time.perf_counter() - wall0
+            stage.cpu += time.process_time() - cpu0
+            stage.calls += 1
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'started': self.started,
+            'wall_s': round(time.perf_counter() - self._wall0, 6),
+            'cpu_s': round(time.process_time() - self._cpu0, 6),
+            'stages': [x.to_dict() for x in self.stages.values()]
+        }
+
+    def summary(self):
+        """
+        One line per stage, for printing.
+        """
+
+        lines = [f'{self.name}:']
+
+        for st in self.stages.values():
+            line = (f'  {st.name}: {st.wall:.2f} s wall, {st.cpu:.2f} s cpu, '
+                    f'{st.rows_in} rows in, {st.rows_out} rows out, '
+                    f'{st.processed} processed')
+            if st.skipped:
+                line += f', skipped {st.skipped}'
+            if st.failed:
+                line += f', failed {st.failed}'
+            lines.append(line)
+
+        return '\n'.join(lines)
+
+    def write(self, path=None):
+        """
+        Print a summary and write the report as JSON (to RDIR by default).
+
+        Parameters:
+            path: str (default None)
+                Path to JSON file (None uses {RDIR}{name}.json).
+        """
+
+        path = path or f'{RDIR}{self.name}.json'
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        print(self.summary())
+
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.replace(tmp_path, path)
+
+        return path
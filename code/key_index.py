@@ -0,0 +1,173 @@
+#
+# Index for looking up plays/player-plays in NGS DataFrames. The frame is
+# sorted by its keys once, after which each key maps to a contiguous range of
+# rows - so grabbing the data for a play is a slice rather than a boolean mask
+# over the whole frame (which made stepping through every play quadratic).
+#
+# Author: Charlie Bonfield
+# Last Modified: 1/2019
+
+## IMPORTS
+import numpy as np
+
+from ngs_schema import _group_starts
+
+## VARIABLES
+PLAY_COLS = ['Season_Year', 'GameKey', 'PlayID']
+PLAYER_COLS = ['Season_Year', 'GameKey', 'PlayID', 'GSISID']
+
+## FUNCTIONS
+def _key_ranges(data, key_cols):
+    """
+    Map each key in a DataFrame sorted by key_cols to its (start, stop) row
+    range.
+
+    Parameters:
+        data: pd.DataFrame
+            DataFrame sorted by key_cols.
+        key_cols: list (str)
+            Key columns.
+    """
+
+    starts = np.flatnonzero(_group_starts(data, key_cols))
+    stops = np.append(starts[1:], len(data))
+    keys = data.iloc[starts].loc[:, key_cols].values.tolist()
+
+    return {tuple(k): (b, e) for k, b, e in zip(keys, starts.tolist(), stops.tolist())}
+
+class KeyIndex:
+    """
+    Sort a DataFrame by a set of key columns (once) and map every key to the
+    range of rows it covers. Any leading subset of the keys can be used for
+    lookups too, e.g. an index on (Season_Year, GameKey, PlayID, GSISID) also
+    answers (Season_Year, GameKey, PlayID) lookups. Other keys (e.g., GSISID on
+    its own) can be added with add_secondary().
+
+    Parameters:
+        data: pd.DataFrame
+            DataFrame to index.
+        key_cols: list (str)
+            Key columns (in sort order).
+        sort_cols: list (str) (default None)
+            Additional columns to sort rows by within each key (e.g., t).
+    """
+
+    def __init__(self, data, key_cols, sort_cols=None):
+
+        self.key_cols = list(key_cols)
+        self.data = data.sort_values(self.key_cols + list(sort_cols or []),
+                                     kind='mergesort').reset_index(drop=True)
+
+        # Ranges for the full key and for each leading subset of it.
+        self._ranges = {
+            n: _key_ranges(self.data, self.key_cols[:n])
+            for n in range(1, len(self.key_cols)+1)
+        }
+        self._keys = list(self._ranges[len(self.key_cols)])
+        self._secondary = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        key = tuple(key)
+        return key in self._ranges.get(len(key), {})
+
+    def __iter__(self):
+        return self.iter_groups()
+
+    def keys(self, n_keys=None):
+        """
+        Keys in sorted order.
+
+        Parameters:
+            n_keys: int (default None)
+                Number of leading key columns (None uses all of them).
+        """
+
+        return list(self._ranges[n_keys or len(self.key_cols)])
+
+    def range(self, key):
+        """
+        Row range (start, stop) for a key (or leading subset of the key).
+
+        Parameters:
+            key: tuple
+                Key values.
+        """
+
+        key = tuple(key)
+
+        return self._ranges[len(key)][key]
+
+    def get(self, key):
+        """
+        Rows for a key (or leading subset of the key).
+
+        Parameters:
+            key: tuple
+                Key values.
+        """
+
+        start, stop = self.range(key)
+
+        return self.data.iloc[start:stop]
+
+    def nth(self, i):
+        """
+        Rows for the i-th key (in sorted order).
+
+        Parameters:
+            i: int
+                Position of key.
+        """
+
+        return self.get(self._keys[i])
+
+    def iter_groups(self, n_keys=None):
+        """
+        Step through each key (in sorted order), yielding the key and its rows.
+
+        Parameters:
+            n_keys: int (default None)
+                Number of leading key columns to group on (None uses all of
+                them).
+        """
+
+        for key, (start, stop) in self._ranges[n_keys or len(self.key_cols)].items():
+            yield key, self.data.iloc[start:stop]
+
+    def add_secondary(self, key_cols):
+        """
+        Add a secondary lookup on a different set of columns. Rows for a
+        secondary key aren't contiguous in the data, so we keep a permutation
+        of the rows sorted by the secondary key instead.
+
+        Parameters:
+            key_cols: list (str)
+                Secondary key columns.
+        """
+
+        key_cols = list(key_cols)
+        order = self.data.loc[:, key_cols].sort_values(key_cols, kind='mergesort').index.values
+        ranges = _key_ranges(self.data.iloc[order].loc[:, key_cols], key_cols)
+
+        self._secondary[tuple(key_cols)] = (order, ranges)
+
+        return self
+
+    def get_secondary(self, key_cols, key):
+        """
+        Rows for a secondary key (see add_secondary).
+
+        Parameters:
+            key_cols: list (str)
+                Secondary key columns.
+            key: tuple
+                Key values.
+        """
+
+        order, ranges = self._secondary[tuple(key_cols)]
+        start, stop = ranges[tuple(key)]
+
+        return self.data.iloc[order[start:stop]]
@@ -17,9 +17,16 @@ from plotly import tools
 import plotly.graph_objs as go
 from plotly.offline import download_plotlyjs, init_notebook_mode, plot, iplot
 
+from event_timeline import pair_window, player_events
+from instrument import RunReport
+from key_index import KeyIndex
+from ngs_schema import read_ngs_csv
+from trim_ngs_data import load_target_keys, read_store_target
+
 
 ## VARIABLES
 DDIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/data/'
+USE_STORE = False # read injury set from columnar store (see ngs_store.py) instead of CSV
 
 
 ## FUNCTIONS
@@ -37,41 +44,12 @@ def trim_player_partner_data(ngs_df):
     play_df = ngs_df.loc[ngs_df.Identifier == 'PLAYER'].dropna().reset_index(drop=True)
     part_df = ngs_df.loc[ngs_df.Identifier == 'PARTNER'].dropna().reset_index(drop=True)
 
-    # Figure out where the ball snap occurred and get the index so that we can
-    # discard all data prior to that instant.
-    try:
-        play_st = play_df.loc[play_df.Event == 'punt'].index[0]
-        part_st = part_df.loc[part_df.Event == 'punt'].index[0]
-    except IndexError:
-        try:
-            play_st = play_df.loc[play_df.Event == 'ball_snap'].index[0]
-            part_st = part_df.loc[part_df.Event == 'ball_snap'].index[0]
-        except IndexError:
-            play_st = play_df.index.min()
-            part_st = part_df.index.min()
-
-    # Figure out where the play "ended" so that we can discard all data after
-    # that. For simplicity, we assume that any concussion event would have occured
-    # prior to a penalty flag being thrown or within five seconds of a tackle.
-    try:
-        play_ei = play_df.loc[play_df.Event == 'penalty_flag'].index[0]
-        part_ei = play_df.loc[play_df.Event == 'penalty_flag'].index[0]
-    except IndexError:
-        try:
-            play_ei = play_df.loc[play_df.Event == 'tackle'].index[0] + 50
-            part_ei = part_df.loc[part_df.Event == 'tackle'].index[0] + 50
-
-            play_ps = play_df.loc[play_df.Event == 'play_submit'].index[0]
-            part_ps = part_df.loc[part_df.Event == 'play_submit'].index[0]
-
-            while play_ei > play_ps:
-                play_ei -= 10
-
-            while part_ei > part_ps:
-                part_ei -= 10
-        except IndexError:
-            play_ei = play_df.index.max()
-            part_ei = part_df.index.max()
+    # Figure out where the play started (punt/snap) and "ended" (penalty flag
+    # or shortly after the tackle) for both player and partner - see
+    # event_timeline.pair_window.
+    (play_st, play_ei), (part_st, part_ei) = pair_window(
+        player_events(play_df), player_events(part_df),
+        len(play_df), len(part_df))
 
     # Slice out the data that we actually need.
     play_df = play_df.iloc[play_st:play_ei]
@@ -93,41 +71,12 @@ def make_plot(ngs_df):
     play_df = ngs_df.loc[ngs_df.Identifier == 'PLAYER'].dropna().reset_index(drop=True)
     part_df = ngs_df.loc[ngs_df.Identifier == 'PARTNER'].dropna().reset_index(drop=True)
 
-    # Figure out where the ball snap occurred and get the index so that we can
-    # discard all data prior to that instant.
-    try:
-        play_st = play_df.loc[play_df.Event == 'punt'].index[0]
-        part_st = part_df.loc[part_df.Event == 'punt'].index[0]
-    except IndexError:
-        try:
-            play_st = play_df.loc[play_df.Event == 'ball_snap'].index[0]
-            part_st = part_df.loc[part_df.Event == 'ball_snap'].index[0]
-        except IndexError:
-            play_st = play_df.index.min()
-            part_st = part_df.index.min()
-
-    # Figure out where the play "ended" so that we can discard all data after
-    # that. For simplicity, we assume that any concussion event would have occured
-    # prior to a penalty flag being thrown or within five seconds of a tackle.
-    try:
-        play_ei = play_df.loc[play_df.Event == 'penalty_flag'].index[0]
-        part_ei = play_df.loc[play_df.Event == 'penalty_flag'].index[0]
-    except IndexError:
-        try:
-            play_ei = play_df.loc[play_df.Event == 'tackle'].index[0] + 50
-            part_ei = part_df.loc[part_df.Event == 'tackle'].index[0] + 50
-
-            play_ps = play_df.loc[play_df.Event == 'play_submit'].index[0]
-            part_ps = part_df.loc[part_df.Event == 'play_submit'].index[0]
-
-            while play_ei > play_ps:
-                play_ei -= 10
-
-            while part_ei > part_ps:
-                part_ei -= 10
-        except IndexError:
-            play_ei = play_df.index.max()
-            part_ei = part_df.index.max()
+    # Figure out where the play started (punt/snap) and "ended" (penalty flag
+    # or shortly after the tackle) for both player and partner - see
+    # event_timeline.pair_window.
+    (play_st, play_ei), (part_st, part_ei) = pair_window(
+        player_events(play_df), player_events(part_df),
+        len(play_df), len(part_df))
 
     # Slice out the data that we actually need.
     play_df = play_df.iloc[play_st:play_ei]
@@ -599,28 +548,28 @@ def make_plot(ngs_df):
 ## MAIN
 if __name__ == '__main__':
 
-    # Load data from plays with concussions.
-    ngs_data = pd.read_csv(f'{DDIR}injury_ngs_data.csv')
+    # Load data from plays with concussions (just the injury games, if reading
+    # from the store).
+    if USE_STORE:
+        ngs_data = read_store_target(load_target_keys('video_injury'))
+    else:
+        ngs_data = read_ngs_csv(f'{DDIR}injury_ngs_data.csv')
 
-    # Add column for easy indexing.
+    # Index plays for easy lookup.
     merge_cols = ['Season_Year', 'GameKey', 'PlayID']
-    ind_df = ngs_data.drop_duplicates(merge_cols).reset_index(drop=True)
-    ind_df.loc[:, 'eventIndex'] = ind_df.index.values
-    play_indexes = ind_df.eventIndex.tolist()
-
-    ind_df = ind_df.loc[:, ['eventIndex', 'Season_Year', 'GameKey', 'PlayID']]
-    ngs_data = ngs_data.merge(ind_df, how='inner', left_on=merge_cols, right_on=merge_cols)
+    play_index = KeyIndex(ngs_data, merge_cols)
+    play_indexes = list(range(len(play_index)))
 
     # Testing.
-    #sp_data = ngs_data.loc[ngs_data.eventIndex == 3].reset_index(drop=True)
+    #sp_data = play_index.nth(3).reset_index(drop=True)
     #figure = make_plot(sp_data)
     #iplot(figure, filename='field-viz')
 
     """
     # Generate set of plots as static files.
-    for play_idx in range(len(ngs_data.eventIndex.unique())):
+    for play_idx in play_indexes:
         try:
-            sp_data = ngs_data.loc[ngs_data.eventIndex == play_idx].reset_index(drop=True)
+            sp_data = play_index.nth(play_idx).reset_index(drop=True)
             figure = make_plot(sp_data)
 
             # Grab some stuff for labeling saved figure.
@@ -1132,7 +1081,7 @@ if __name__ == '__main__':
     plt_dicts = []
     pidx = 0
 
-    sp_data = ngs_data.loc[ngs_data.eventIndex == pidx].reset_index(drop=True)
+    sp_data = play_index.nth(pidx).reset_index(drop=True)
 
     # Grab some stuff for labeling saved figure.
     sy = sp_data.Season_Year.values[0]
@@ -1190,83 +1139,90 @@ if __name__ == '__main__':
     }
     figure['data'].append(data_dict)
 
-    # Make frames.
-    for pidx in play_indexes:
-        frame = {'data': [], 'name': pidx}
-        try:
-            print(pidx)
-            sp_data = ngs_data.loc[ngs_data.eventIndex == pidx].reset_index(drop=True)
-
-            # Grab some stuff for labeling saved figure.
-            sy = sp_data.Season_Year.values[0]
-            gk = sp_data.GameKey.values[0]
-            pi = sp_data.PlayID.values[0]
-
-            plt_dict = {}
-            plt_dict['playIndex'] = pi
-            plt_dict['seasonYear'] = sy
-            plt_dict['gameKey'] = gk
-            plt_dict['playID'] = pi
-            plt_dicts.append(plt_dict)
-
-            # Get player/partner data (reduced).
-            rd_play_df, rd_part_df = trim_player_partner_data(sp_data)
-
-            for i in range(2):
-                if not i:
-                    ngs_dataset = rd_play_df.copy()
-                    plt_name = 'Player'
-                    color_scale = 'Reds'
-                    cb_loc = 1.0
-                else:
-                    ngs_dataset = rd_part_df.copy()
-                    plt_name = 'Partner'
-                    color_scale = 'Blues'
-                    cb_loc = 1.1
+    # Make frames (keeping track of plays that couldn't be drawn - see
+    # instrument.py).
+    report = RunReport('make_field_visualization')
+
+    with report.stage('frames') as stage:
+        for pidx in play_indexes:
+            frame = {'data': [], 'name': pidx}
+            try:
+                print(pidx)
+                sp_data = play_index.nth(pidx).reset_index(drop=True)
+
+                # Grab some stuff for labeling saved figure.
+                sy = sp_data.Season_Year.values[0]
+                gk = sp_data.GameKey.values[0]
+                pi = sp_data.PlayID.values[0]
+
+                plt_dict = {}
+                plt_dict['playIndex'] = pi
+                plt_dict['seasonYear'] = sy
+                plt_dict['gameKey'] = gk
+                plt_dict['playID'] = pi
+                plt_dicts.append(plt_dict)
+
+                # Get player/partner data (reduced).
+                rd_play_df, rd_part_df = trim_player_partner_data(sp_data)
+
+                for i in range(2):
+                    if not i:
+                        ngs_dataset = rd_play_df.copy()
+                        plt_name = 'Player'
+                        color_scale = 'Reds'
+                        cb_loc = 1.0
+                    else:
+                        ngs_dataset = rd_part_df.copy()
+                        plt_name = 'Partner'
+                        color_scale = 'Blues'
+                        cb_loc = 1.1
+
+                    data_dict = {
+                        'x': list(ngs_dataset['x']),
+                        'y': list(ngs_dataset['y']),
+                        'mode': 'markers',
+                        'marker': {
+                            'color': list(ngs_dataset['s']),
+                            'colorbar': {'x':cb_loc},
+                            'colorscale':color_scale,
+                            'size':12
+                        },
+                        'name':plt_name
+                    }
+                    frame['data'].append(data_dict)
 
+                # Add data for yardline trace.
                 data_dict = {
-                    'x': list(ngs_dataset['x']),
-                    'y': list(ngs_dataset['y']),
-                    'mode': 'markers',
-                    'marker': {
-                        'color': list(ngs_dataset['s']),
-                        'colorbar': {'x':cb_loc},
-                        'colorscale':color_scale,
-                        'size':12
-                    },
-                    'name':plt_name
+                    'x': [20, 30, 40, 50, 60, 70, 80, 90, 100],
+                    'y': [1, 1, 1, 1, 1, 1, 1, 1, 1],
+                    'mode': 'text',
+                    'text': ['10','20','30','40','50','40','30','20','10'],
+                    'textposition': 'top center',
+                    'textfont': {
+                        'family': 'sans serif',
+                        'size': 20,
+                        'color': 'white'
+                    }
                 }
                 frame['data'].append(data_dict)
 
-            # Add data for yardline trace.
-            data_dict = {
-                'x': [20, 30, 40, 50, 60, 70, 80, 90, 100],
-                'y': [1, 1, 1, 1, 1, 1, 1, 1, 1],
-                'mode': 'text',
-                'text': ['10','20','30','40','50','40','30','20','10'],
-                'textposition': 'top center',
-                'textfont': {
-                    'family': 'sans serif',
-                    'size': 20,
-                    'color': 'white'
-                }
-            }
-            frame['data'].append(data_dict)
-
-            # Add frames.
-            figure['frames'].append(frame)
-            slider_step = {'args': [
-                [pidx],
-                {'frame': {'duration': 300, 'redraw': False},
-                 'mode': 'immediate',
-               'transition': {'duration': 300}}
-             ],
-             'label': pidx,
-             'method': 'animate'}
-            sliders_dict['steps'].append(slider_step)
-        except TypeError:
-            continue
+                # Add frames.
+                figure['frames'].append(frame)
+                slider_step = {'args': [
+                    [pidx],
+                    {'frame': {'duration': 300, 'redraw': False},
+                     'mode': 'immediate',
+                   'transition': {'duration': 300}}
+                 ],
+                 'label': pidx,
+                 'method': 'animate'}
+                sliders_dict['steps'].append(slider_step)
+                stage.process()
+            except TypeError:
+                stage.fail('TypeError')
+                continue
 
     figure['layout']['sliders'] = [sliders_dict]
+    report.write()
 
     iplot(figure)
@@ -0,0 +1,179 @@
+#
+# Build manifest for the NGS processing stages. For every output we record the
+# inputs it was built from (content hash, size, modification time), the
+# parameters used, and a hash of the code that built it. A stage can then skip
+# any input whose outputs are still valid, so adding a season or fixing a
+# single file only costs that file's processing time.
+#
+# Author: Charlie Bonfield
+# Last Modified: 1/2019
+
+## IMPORTS
+import os
+import json
+import hashlib
+
+## VARIABLES
+CHUNK_SIZE = 1 << 20 # bytes read at a time when hashing
+
+## FUNCTIONS
+def file_digest(path):
+    """
+    SHA-1 hash of a file's contents (read in chunks, so this is fine for the
+    multi-GB NGS files).
+
+    Parameters:
+        path: str
+            Path to file.
+    """
+
+    sha = hashlib.sha1()
+
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+def code_version(*paths):
+    """
+    Hash of the source files that make up a stage. Any edit to these files
+    invalidates that stage's outputs.
+
+    Parameters:
+        paths: str
+            Paths to source files.
+    """
+
+    sha = hashlib.sha1()
+
+    for path in paths:
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+
+    return sha.hexdigest()
+
+def params_version(params):
+    """
+    Hash of a (JSON-serializable) set of parameters.
+
+    Parameters:
+        params: dict
+            Parameters for a stage.
+    """
+
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+class Manifest:
+    """
+    JSON manifest of the outputs built by one or more stages (see the comment
+    at the top of the file).
+
+    Parameters:
+        path: str
+            Path to manifest file (created on first save).
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+        else:
+            self.entries = {}
+
+    def _file_info(self, path, known=None):
+        st = os.stat(path)
+        info = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+        # Only re-hash a file if its size/mtime have changed.
+        if known and all(known.get(k) == v for k, v in info.items()):
+            info['sha1'] = known['sha1']
+        else:
+            info['sha1'] = file_digest(path)
+
+        return info
+
+    def _files_match(self, paths, recorded):
+        if sorted(paths) != sorted(recorded):
+            return False
+
+        for path in paths:
+            if not os.path.exists(path):
+                return False
+            if self._file_info(path, recorded[path])['sha1'] != recorded[path]['sha1']:
+                return False
+
+        return True
+
+    def is_current(self, stage, inputs, outputs, params=None, code=None):
+        """
+        Check whether the outputs of a stage are up to date (same inputs,
+        parameters, and code as when they were built, and untouched since).
+
+        Parameters:
+            stage: str
+                Name of stage.
+            inputs: list (str)
+                Paths to input files.
+            outputs: list (str)
+                Paths to output files.
+            params: dict (default None)
+                Parameters for the stage.
+            code: str (default None)
+                Code version (see code_version).
+        """
+
+        entry = self.entries.get(stage, {}).get(outputs[0])
+
+        if entry is None:
+            return False
+        if entry['params'] != params_version(params) or entry['code'] != code:
+            return False
+
+        return (self._files_match(inputs, entry['inputs']) and
+                self._files_match(outputs, entry['outputs']))
+
+    def record(self, stage, inputs, outputs, params=None, code=None):
+        """
+        Record a freshly built set of outputs and save the manifest.
+
+        Parameters:
+            stage: str
+                Name of stage.
+            inputs: list (str)
+                Paths to input files.
+            outputs: list (str)
+                Paths to output files.
+            params: dict (default None)
+                Parameters for the stage.
+            code: str (default None)
+                Code version (see code_version).
+        """
+
+        old = self.entries.get(stage, {}).get(outputs[0], {})
+
+        entry = {
+            'inputs': {x: self._file_info(x, old.get('inputs', {}).get(x)) for x in inputs},
+            'outputs': {x: self._file_info(x) for x in outputs},
+            'params': params_version(params),
+            'code': code
+        }
+        self.entries.setdefault(stage, {})[outputs[0]] = entry
+
+        self.save()
+
+    def save(self):
+        """
+        Write the manifest to disk (via a temporary file, so a crash never
+        leaves a corrupt manifest behind).
+        """
+
+        tmp_path = f'{self.path}.tmp'
+
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+
+        os.replace(tmp_path, self.path)
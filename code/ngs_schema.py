@@ -0,0 +1,154 @@
+#
+# Compact column types for NGS data. Loading the NGS files with pandas' default
+# types (object strings, int64 keys, float64 everything) takes several times
+# more memory than needed, so every loader should go through read_ngs_csv() or
+# apply_schema() below.
+#
+# Author: Charlie Bonfield
+# Last Modified: 1/2019
+
+## IMPORTS
+import os
+import glob
+import numpy as np
+import pandas as pd
+
+## VARIABLES
+DDIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/data/wdynamics/'
+TIME_FMT = '%Y-%m-%d %H:%M:%S.%f' # format of the Time column
+
+# Keys (nullable equivalents are used if a column has missing values).
+KEY_DTYPES = {
+    'Season_Year': 'int16',
+    'GameKey': 'int16',
+    'PlayID': 'int16',
+    'GSISID': 'int32',
+    'Primary_Partner_GSISID': 'int32'
+}
+
+# Positions/kinematics.
+FLOAT_DTYPES = {
+    x: 'float32' for x in ['x', 'y', 'dis', 'o', 'dir', 'vx', 'vy', 's',
+                           'ax', 'ay', 'a']
+}
+
+# Low-cardinality strings.
+CATEGORY_COLS = ['Event', 'Role', 'Identifier']
+
+## FUNCTIONS
+def _group_starts(data, key_cols):
+    """
+    Flag the first row of each group in a DataFrame that has already been
+    sorted by key_cols.
+
+    Parameters:
+        data: pd.DataFrame
+            DataFrame sorted by key_cols.
+        key_cols: list (str)
+            Columns defining a group.
+    """
+
+    new_grp = np.zeros(len(data), dtype=bool)
+    if len(data):
+        new_grp[0] = True
+
+    for col in key_cols:
+        vals = data[col].to_numpy(dtype=float, na_value=np.nan)
+        new_grp[1:] |= vals[1:] != vals[:-1]
+
+    return new_grp
+
+def apply_schema(ngs_df):
+    """
+    Convert the columns of an NGS DataFrame (in place) to their compact types.
+    Columns that aren't part of the schema are left alone.
+
+    Parameters:
+        ngs_df: pd.DataFrame
+            DataFrame containing NGS data.
+    """
+
+    for col, dtype in KEY_DTYPES.items():
+        if col in ngs_df.columns:
+            if ngs_df[col].isnull().any():
+                dtype = dtype.capitalize()
+            ngs_df[col] = ngs_df[col].astype(dtype)
+
+    for col, dtype in FLOAT_DTYPES.items():
+        if col in ngs_df.columns:
+            ngs_df[col] = ngs_df[col].astype(dtype)
+
+    for col in CATEGORY_COLS:
+        if col in ngs_df.columns:
+            ngs_df[col] = ngs_df[col].astype('category')
+
+    return ngs_df
+
+def read_dtypes(file_path):
+    """
+    Get the dtype argument for pd.read_csv for a given NGS file (only the
+    columns present in the file are included). Keys are left out, since they
+    may contain missing values - see read_ngs_csv.
+
+    Parameters:
+        file_path: str
+            Path to NGS dataset (CSV).
+    """
+
+    columns = pd.read_csv(file_path, nrows=0).columns
+    dtypes = {x: FLOAT_DTYPES[x] for x in columns if x in FLOAT_DTYPES}
+    dtypes.update({x: 'category' for x in columns if x in CATEGORY_COLS})
+
+    return dtypes
+
+def read_ngs_csv(file_path, **kwargs):
+    """
+    Drop-in replacement for pd.read_csv for NGS files that applies the compact
+    schema while reading. Extra keyword arguments are passed to pd.read_csv;
+    if chunksize is given, the chunks are converted as they're read.
+
+    Parameters:
+        file_path: str
+            Path to NGS dataset (CSV).
+    """
+
+    if 'dtype' not in kwargs:
+        kwargs['dtype'] = read_dtypes(file_path)
+    reader = pd.read_csv(file_path, **kwargs)
+
+    if 'chunksize' in kwargs or kwargs.get('iterator', False):
+        return (apply_schema(chunk) for chunk in reader)
+    else:
+        return apply_schema(reader)
+
+def memory_report(file_paths):
+    """
+    Compare the in-memory size of NGS files loaded with pandas' default types
+    against the compact schema.
+
+    Parameters:
+        file_paths: list (str)
+            Paths to NGS datasets (CSV).
+    """
+
+    rows = []
+
+    for fp in file_paths:
+        before = pd.read_csv(fp).memory_usage(deep=True).sum()
+        after = read_ngs_csv(fp).memory_usage(deep=True).sum()
+
+        rows.append({
+            'file': os.path.basename(fp),
+            'before_mb': before / 1024**2,
+            'after_mb': after / 1024**2,
+            'ratio': before / after
+        })
+
+    return pd.DataFrame(rows, columns=['file', 'before_mb', 'after_mb', 'ratio'])
+
+
+## MAIN
+if __name__ == '__main__':
+
+    report = memory_report(sorted(glob.glob(f'{DDIR}*.csv')))
+    print(report.to_string(index=False))
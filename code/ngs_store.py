@@ -0,0 +1,126 @@
+#
+# Script for converting the NGS data (raw and with dynamics) into a columnar
+# store. Data is written as Parquet (with the types from ngs_schema.py),
+# partitioned by Season_Year/Season_Type/GameKey, so that downstream scripts
+# can read just the columns and games they need instead of re-parsing the full
+# CSVs.
+#
+# Author: Charlie Bonfield
+# Last Modified: 1/2019
+
+## IMPORTS
+import os
+import glob
+import pandas as pd
+
+from ngs_schema import TIME_FMT, apply_schema, read_ngs_csv
+
+## VARIABLES
+RDIR = '/Users/cbonfield/Dropbox/nfl_punts/raw/'
+DDIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/data/wdynamics/'
+SDIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/data/ngs_store/'
+
+PART_COLS = ['Season_Year', 'Season_Type', 'GameKey']
+SEASON_TYPES = {'pre': 'Pre', 'reg': 'Reg', 'post': 'Post'}
+
+## FUNCTIONS
+def season_type_from_file(file_name):
+    """
+    Pull the season type (Pre, Reg, Post) out of an NGS file name (e.g.,
+    NGS-2017-reg.csv).
+
+    Parameters:
+        file_name: str
+            Name of NGS dataset.
+    """
+
+    tag = os.path.basename(file_name).split('.csv')[0].split('-')[-1]
+
+    return SEASON_TYPES[tag.lower()]
+
+def convert_ngs_file(file_path, kind='wdynamics'):
+    """
+    Convert a single NGS CSV to the columnar store. Any partitions that already
+    exist for the games in this file are replaced.
+
+    Parameters:
+        file_path: str
+            Path to NGS dataset (CSV).
+        kind: str (default 'wdynamics')
+            Name of the store to write to ('raw' or 'wdynamics').
+    """
+
+    ngs_df = read_ngs_csv(file_path)
+    ngs_df = ngs_df.assign(Time=pd.to_datetime(ngs_df.Time, format=TIME_FMT),
+                           Season_Type=season_type_from_file(file_path))
+
+    ngs_df.to_parquet(f'{SDIR}{kind}', engine='pyarrow', index=False,
+                      partition_cols=PART_COLS,
+                      existing_data_behavior='delete_matching')
+
+    return len(ngs_df)
+
+def list_partitions(kind='wdynamics'):
+    """
+    List the (Season_Year, Season_Type) partitions available in the store.
+
+    Parameters:
+        kind: str (default 'wdynamics')
+            Name of the store ('raw' or 'wdynamics').
+    """
+
+    parts = []
+
+    for pdir in sorted(glob.glob(f'{SDIR}{kind}/Season_Year=*/Season_Type=*')):
+        season_type = os.path.basename(pdir).split('=')[1]
+        season_year = int(os.path.basename(os.path.dirname(pdir)).split('=')[1])
+        parts.append((season_year, season_type))
+
+    return parts
+
+def read_ngs(kind='wdynamics', columns=None, season_year=None, season_type=None,
+             game_keys=None):
+    """
+    Load NGS data from the columnar store. Only the requested columns are read,
+    and partitions that don't match the filters are skipped entirely.
+
+    Parameters:
+        kind: str (default 'wdynamics')
+            Name of the store ('raw' or 'wdynamics').
+        columns: list (str) (default None)
+            Columns to load (None loads everything).
+        season_year: int or list (ints) (default None)
+            Season(s) to load.
+        season_type: str or list (str) (default None)
+            Season type(s) to load (Pre, Reg, Post).
+        game_keys: list (ints) (default None)
+            Games to load.
+    """
+
+    filters = []
+
+    if season_year is not None:
+        filters.append(('Season_Year', 'in', list(pd.Series(season_year).astype(int))))
+    if season_type is not None:
+        filters.append(('Season_Type', 'in', list(pd.Series(season_type).astype(str))))
+    if game_keys is not None:
+        filters.append(('GameKey', 'in', list(pd.Series(game_keys).astype(int))))
+
+    ngs_df = pd.read_parquet(f'{SDIR}{kind}', engine='pyarrow', columns=columns,
+                             filters=filters if filters else None)
+
+    # Partition columns come back as categoricals, so restore their types.
+    if 'Season_Type' in ngs_df.columns:
+        ngs_df['Season_Type'] = ngs_df.Season_Type.astype(str)
+
+    return apply_schema(ngs_df)
+
+
+## MAIN
+if __name__ == '__main__':
+
+    # Convert raw NGS data and NGS data with dynamics.
+    for kind, cdir in [('raw', RDIR), ('wdynamics', DDIR)]:
+        for nfil in sorted(glob.glob(f'{cdir}NGS*.csv')):
+            print(kind, os.path.basename(nfil))
+            convert_ngs_file(nfil, kind=kind)
@@ -5,79 +5,393 @@
 # Last Modified: 12/2018
 
 ## IMPORTS
+import io
 import os
 import glob
 import math
+import time
+import shutil
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from scipy.signal import savgol_coeffs
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import event_timeline
+import ngs_schema
+from event_timeline import sorted_event_timeline, timeline_path
+from instrument import RunReport
+from manifest import Manifest, code_version
+from ngs_schema import TIME_FMT, _group_starts, read_dtypes, read_ngs_csv
+from ngs_store import read_ngs, season_type_from_file
+
 ## VARIABLES
 WDIR = '/Users/cbonfield/Dropbox/nfl_punts/raw/'
 ODIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/data/wdynamics/'
+PLAY_COLS = ['Season_Year', 'GameKey', 'PlayID']
+USE_STORE = False # read raw data from columnar store (see ngs_store.py) instead of CSVs
+SHARD_BYTES = 256 * (1 << 20) # approximate amount of CSV handled by each task in run_batch
+SHARD_ROWS = 3000000 # approximate number of rows handled by each task in run_batch (store)
 
 ## FUNCTIONS
-def compute_dynamics(data):
+def _backward_diff(vals, new_grp):
+    """
+    First (backward) difference of a flat array that holds many groups back to
+    back. The first row of each group has no predecessor, so it gets a nan.
+
+    Parameters:
+        vals: np.array
+            Values to difference.
+        new_grp: np.array (bool)
+            Group start flags (see _group_starts).
+    """
+
+    diff = np.empty(len(vals), dtype=float)
+    if len(vals):
+        diff[0] = np.nan
+        diff[1:] = vals[1:] - vals[:-1]
+    diff[new_grp] = np.nan
+
+    return diff
+
+def _central_derivative(vals, t, new_grp):
+    """
+    Derivative of a flat array that holds many groups back to back, using
+    central differences in the interior of each group and one-sided
+    differences at either end (single-row groups get a nan).
+
+    Parameters:
+        vals: np.array
+            Values to differentiate.
+        t: np.array
+            Times.
+        new_grp: np.array (bool)
+            Group start flags (see _group_starts).
+    """
+
+    rows = np.arange(len(vals))
+    grp_end = np.append(new_grp[1:], True)
+
+    # Neighbouring rows (a row stands in for its missing neighbour at either
+    # end of a group).
+    nxt = np.where(grp_end, rows, rows+1)
+    prv = np.where(new_grp, rows, rows-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        deriv = (vals[nxt] - vals[prv]) / (t[nxt] - t[prv])
+    deriv[~np.isfinite(deriv)] = np.nan
+
+    return deriv
+
+def _savgol_derivative(vals, new_grp, window, order, deriv, delta, fallback):
+    """
+    Savitzky-Golay derivative of a flat array that holds many groups back to
+    back. The filter is run over the whole array at once, and rows whose
+    window would run across a group boundary are taken from fallback instead.
+    Assumes (roughly) uniform sampling with spacing delta.
+
+    Parameters:
+        vals: np.array
+            Values to differentiate.
+        new_grp: np.array (bool)
+            Group start flags (see _group_starts).
+        window: int
+            Filter window length (odd).
+        order: int
+            Order of the fitted polynomial.
+        deriv: int
+            Order of the derivative.
+        delta: float
+            Sample spacing.
+        fallback: np.array
+            Values to use near group boundaries.
+    """
+
+    if len(vals) < window:
+        return fallback
+
+    coeffs = savgol_coeffs(window, order, deriv=deriv, delta=delta, use='conv')
+    smooth = np.convolve(vals, coeffs, mode='same')
+
+    # Position of each row within its group and the length of that group.
+    grp_num = np.cumsum(new_grp) - 1
+    grp_first = np.flatnonzero(new_grp)
+    grp_len = np.diff(np.append(grp_first, len(vals)))
+    pos = np.arange(len(vals)) - grp_first[grp_num]
+
+    half = window // 2
+    inside = (pos >= half) & (pos < grp_len[grp_num] - half)
+
+    return np.where(inside, smooth, fallback)
+
+def compute_dynamics(data, method='backward', window=7, order=2):
     """
     Compute velocity/acceleration given the NGS data (we have x and y positions
     as well as time).
 
+    Everything is done in a single pass: the data is sorted once by player/play
+    and time, and differences are taken over the whole frame at once (with the
+    first row of each player/play masked out so that we never difference
+    across a group boundary).
+
     Parameters:
         data: pd.DataFrame
             DataFrame containing NGS data.
+        method: str (default 'backward')
+            Derivative estimate to use. Supported values are:
+                backward: backward first differences (velocity from position,
+                          then acceleration from velocity)
+                central: central differences (one-sided at either end of a
+                         player/play)
+                savgol: Savitzky-Golay filter (velocity/acceleration are the
+                        first/second derivatives of the local polynomial fit
+                        to position; central differences near the ends)
+        window: int (default 7)
+            Window length for savgol (odd; 7 samples is 0.7 s at 10 Hz).
+        order: int (default 2)
+            Polynomial order for savgol.
     """
 
     MER_COLS = ['Season_Year', 'GameKey', 'PlayID', 'GSISID']
 
-    # Calculate time/position differences to estimate velocity/speed.
-    grp_df = data.groupby(MER_COLS).apply(lambda x: x.sort_values('t').reset_index(drop=True))
-    x_diff = data.groupby(MER_COLS).apply(lambda x: x.sort_values('t').reset_index(drop=True)).x.diff()
-    y_diff = data.groupby(MER_COLS).apply(lambda x: x.sort_values('t').reset_index(drop=True)).y.diff()
-    t_diff = data.groupby(MER_COLS).apply(lambda x: x.sort_values('t').reset_index(drop=True)).t.diff()
-
-    # Tack on dx, dy, and dt (adding column in place works better than an actual
-    # merge here).
-    grp_df = grp_df.reset_index(drop=True)
-    grp_df.loc[:, 'dx'] = x_diff.values
-    grp_df.loc[:, 'dy'] = y_diff.values
-    grp_df.loc[:, 'dt'] = t_diff.values
-    #grp_df.fillna(0.0, inplace=True)
-
-    # Add vx(t), vy(t) to grp_df.
-    grp_df.loc[:, 'vx'] = grp_df.dx / grp_df.dt
-    grp_df.loc[:, 'vy'] = grp_df.dy / grp_df.dt
-    grp_df.replace([np.inf, -np.inf], np.nan, inplace=True)
-    #grp_df.fillna(0.0, inplace=True)
-
-    # Add speed (sqrt(vx^2+vy^2)) as a function of time, too.
-    vx = grp_df.vx.values
-    vy = grp_df.vy.values
-    speed = np.sqrt(np.square(vx)+np.square(vy))
-    grp_df.loc[:, 's'] = speed
-
-    # Calculate velocity differences to estimate acceleration.
-    dvx_diff = grp_df.groupby(MER_COLS).apply(lambda x: x.sort_values('t').reset_index(drop=True)).vx.diff()
-    dvy_diff = grp_df.groupby(MER_COLS).apply(lambda x: x.sort_values('t').reset_index(drop=True)).vy.diff()
-
-    # Add ax(t), ay(t) to grp_df.
-    grp_df.loc[:, 'dvx'] = dvx_diff.values
-    grp_df.loc[:, 'dvy'] = dvy_diff.values
-    grp_df.loc[:, 'ax'] = grp_df.dvx / grp_df.dt
-    grp_df.loc[:, 'ay'] = grp_df.dvy / grp_df.dt
-    grp_df.replace([np.inf, -np.inf], np.nan, inplace=True)
-
-    # Add magnitude of acceleration, too.
-    ax = grp_df.ax.values
-    ay = grp_df.ay.values
-    acc_mag = np.sqrt(np.square(ax)+np.square(ay))
-    grp_df.loc[:, 'a'] = acc_mag
-
-    # Drop differential columns.
-    diff_cols = ['dx', 'dy', 'dt', 'dvx', 'dvy']
-    grp_df.drop(diff_cols, axis=1, inplace=True)
+    # Sort once by player/play and time (stable, so ties keep file order).
+    grp_df = data.sort_values(MER_COLS + ['t'], kind='mergesort')
+    grp_df.reset_index(drop=True, inplace=True)
+    new_grp = _group_starts(grp_df, MER_COLS)
+
+    x = grp_df.x.values.astype(float)
+    y = grp_df.y.values.astype(float)
+    t = grp_df.t.values.astype(float)
+
+    if method == 'backward':
+        # Calculate time/position differences to estimate velocity/speed.
+        x_diff = _backward_diff(x, new_grp)
+        y_diff = _backward_diff(y, new_grp)
+        t_diff = _backward_diff(t, new_grp)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vx = x_diff / t_diff
+            vy = y_diff / t_diff
+        vx[~np.isfinite(vx)] = np.nan
+        vy[~np.isfinite(vy)] = np.nan
+
+        # Calculate velocity differences to estimate acceleration.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ax = _backward_diff(vx, new_grp) / t_diff
+            ay = _backward_diff(vy, new_grp) / t_diff
+        ax[~np.isfinite(ax)] = np.nan
+        ay[~np.isfinite(ay)] = np.nan
+    elif method in ['central', 'savgol']:
+        vx = _central_derivative(x, t, new_grp)
+        vy = _central_derivative(y, t, new_grp)
+        ax = _central_derivative(vx, t, new_grp)
+        ay = _central_derivative(vy, t, new_grp)
+
+        if method == 'savgol':
+            if window % 2 == 0 or window <= order:
+                raise ValueError('window must be odd and larger than order!')
+
+            # Sampling interval (10 Hz for NGS data).
+            delta = np.nanmedian(_backward_diff(t, new_grp))
+
+            vx = _savgol_derivative(x, new_grp, window, order, 1, delta, vx)
+            vy = _savgol_derivative(y, new_grp, window, order, 1, delta, vy)
+            ax = _savgol_derivative(x, new_grp, window, order, 2, delta, ax)
+            ay = _savgol_derivative(y, new_grp, window, order, 2, delta, ay)
+    else:
+        raise ValueError('Not a valid option!')
+
+    # Add vx(t), vy(t), speed, ax(t), ay(t), and magnitude of acceleration.
+    grp_df.loc[:, 'vx'] = vx
+    grp_df.loc[:, 'vy'] = vy
+    grp_df.loc[:, 's'] = np.sqrt(np.square(vx)+np.square(vy))
+    grp_df.loc[:, 'ax'] = ax
+    grp_df.loc[:, 'ay'] = ay
+    grp_df.loc[:, 'a'] = np.sqrt(np.square(ax)+np.square(ay))
 
     return grp_df
 
+def add_relative_times(ngs_df):
+    """
+    Compute relative time (with respect to the start of the play) for a set of
+    NGS data. Every play must be complete within ngs_df.
+
+    Time is parsed once (with an explicit format) and kept both as a datetime
+    (Time) and as int64 nanoseconds since the epoch (Time_ns), so later stages
+    never have to parse the time strings again.
+
+    Parameters:
+        ngs_df: pd.DataFrame
+            DataFrame containing (raw) NGS data.
+    """
+
+    # Parse times.
+    times = pd.to_datetime(ngs_df.Time, format=TIME_FMT)
+    time_ns = times.values.astype('datetime64[ns]').astype(np.int64)
+
+    ngs_df = ngs_df.assign(Time=times, Time_ns=time_ns)
+
+    # Get the play start times and subtract them off.
+    play_start = ngs_df.groupby(PLAY_COLS, sort=False).Time_ns.transform('min').values
+    ngs_df.loc[:, 't'] = (time_ns - play_start) / 1e9
+
+    return ngs_df
+
+def _season(file_name):
+    # Season year/type of an NGS file (e.g., NGS-2017-post.csv -> 2017, Post).
+    return int(os.path.basename(file_name).split('-')[1]), season_type_from_file(file_name)
+
+def read_raw_ngs(file_name, shard=None, **kwargs):
+    """
+    Load (part of) a raw NGS dataset, either from WDIR or (if USE_STORE) from
+    the columnar store (see ngs_store.py). Extra keyword arguments are passed
+    to read_ngs_csv; with chunksize, an iterator of DataFrames is returned
+    either way.
+
+    Parameters:
+        file_name: str
+            Name of NGS dataset (e.g., NGS-2017-post.csv).
+        shard: tuple or list (default None)
+            Part of the dataset to load (see plan_shards) - a (start, stop)
+            byte range of the CSV, or a list of GameKeys with USE_STORE. None
+            loads everything.
+    """
+
+    if not USE_STORE:
+        file_path = f'{WDIR}{file_name}'
+        if shard is None:
+            return read_ngs_csv(file_path, **kwargs)
+
+        # Parse just this byte range (with the header stuck on the front).
+        with open(file_path, 'rb') as f:
+            header = f.readline()
+            f.seek(shard[0])
+            buf = f.read(shard[1] - shard[0])
+
+        if 'dtype' not in kwargs:
+            kwargs['dtype'] = read_dtypes(file_path)
+
+        return read_ngs_csv(io.BytesIO(header + buf), **kwargs)
+
+    season_year, season_type = _season(file_name)
+    ngs_df = read_ngs(kind='raw', season_year=season_year,
+                      season_type=season_type, game_keys=shard)
+
+    # Partition columns come back last - put them back where the CSVs have
+    # them. Partitions are read in directory order (GameKey=10 before
+    # GameKey=2), so put the games back in order too.
+    other_cols = [x for x in ngs_df.columns if x not in ['Season_Year', 'GameKey', 'Season_Type']]
+    ngs_df = ngs_df.loc[:, ['Season_Year', 'GameKey'] + other_cols]
+    ngs_df = ngs_df.sort_values(['Season_Year', 'GameKey'], kind='mergesort',
+                                ignore_index=True)
+
+    return iter([ngs_df]) if 'chunksize' in kwargs else ngs_df
+
+def _check_play_order(data, last_key=None):
+    """
+    Make sure the plays in a DataFrame are contiguous and in key order
+    (PLAY_COLS), carrying on from the last play seen before it. A play that
+    shows up again later on would otherwise get the wrong relative times and
+    dynamics without any error. Returns the key of the last play.
+
+    Parameters:
+        data: pd.DataFrame
+            NGS data.
+        last_key: np.array (default None)
+            Key of the play before data (see return value).
+    """
+
+    starts = np.flatnonzero(_group_starts(data, PLAY_COLS))
+    keys = data.loc[:, PLAY_COLS].to_numpy(dtype=float, na_value=np.nan)[starts]
+    if last_key is not None:
+        keys = np.vstack([last_key, keys])
+
+    # Each key has to come after the one before it (first differing column
+    # goes up).
+    diff = np.diff(keys, axis=0)
+    first = np.argmax(diff != 0, axis=1)
+    bad = np.flatnonzero(~(diff[np.arange(len(diff)), first] > 0))
+
+    if len(bad):
+        play, prev = ['/'.join(f'{x:g}' for x in keys[i]) for i in [bad[0]+1, bad[0]]]
+        raise ValueError(f'Play {play} comes after play {prev} - rows for each '
+                         'play must be contiguous and sorted by key!')
+
+    return keys[-1] if len(keys) else last_key
+
+def _line_game_key(line, col):
+    # Raw GameKey field of a CSV line (col is its position in the header).
+    return line.rstrip(b'\r\n').split(b',', col + 1)[col]
+
+def plan_shards(file_name, shard_bytes=SHARD_BYTES, shard_rows=SHARD_ROWS):
+    """
+    Split an NGS dataset into GameKey-range shards of roughly equal size (see
+    run_batch). A play never spans two shards.
+
+    For CSVs, shards are byte ranges that start where GameKey changes (found
+    by seeking to evenly spaced offsets and reading forward to the end of the
+    game), so each worker only parses its own part of the file. This assumes
+    the rows are sorted by key, as for iter_play_chunks - GameKey has to go up
+    at each cut (a ValueError is raised otherwise), and each shard checks its
+    own plays as it's processed (see _check_play_order). With USE_STORE,
+    shards are lists of GameKeys (i.e., store partitions).
+
+    Parameters:
+        file_name: str
+            Name of NGS dataset.
+        shard_bytes: int (default SHARD_BYTES)
+            Approximate size of each shard (CSV).
+        shard_rows: int (default SHARD_ROWS)
+            Approximate number of rows in each shard (store).
+    """
+
+    if USE_STORE:
+        season_year, season_type = _season(file_name)
+        game_keys = read_ngs(kind='raw', columns=['GameKey'], season_year=season_year,
+                             season_type=season_type).GameKey
+        counts = game_keys.value_counts().sort_index()
+
+        shard_num = (np.cumsum(counts.values) - 1) // shard_rows
+        return [counts.index[shard_num == i].astype(int).tolist()
+                for i in np.unique(shard_num)]
+
+    file_path = f'{WDIR}{file_name}'
+    size = os.path.getsize(file_path)
+
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        col = header.rstrip(b'\r\n').split(b',').index(b'GameKey')
+        cuts = [f.tell()]
+        n_shards = max(1, math.ceil((size - cuts[0]) / shard_bytes))
+
+        for i in range(1, n_shards):
+            target = cuts[0] + (size - cuts[0]) * i // n_shards
+            if target <= cuts[-1]:
+                continue
+
+            # Skip to the first full line after target, then on to the first
+            # line of the next game.
+            f.seek(target - 1)
+            f.readline()
+            line = f.readline()
+            game_key = _line_game_key(line, col) if line else None
+
+            while line:
+                pos = f.tell()
+                line = f.readline()
+                next_key = _line_game_key(line, col) if line else game_key
+                if next_key != game_key:
+                    if float(next_key) < float(game_key):
+                        raise ValueError(f'GameKey {int(next_key)} comes after GameKey '
+                                         f'{int(game_key)} - rows must be sorted by key!')
+                    cuts.append(pos)
+                    break
+
+    cuts.append(size)
+
+    return [(x, y) for x, y in zip(cuts[:-1], cuts[1:]) if y > x]
+
 def get_relative_times(file_name):
     """
     Given the name of an NGS dataset, compute relative time (with respect to the
@@ -89,24 +403,347 @@ def get_relative_times(file_name):
     """
 
     # Load in NGS dataset.
-    ngs_df = pd.read_csv(f'{WDIR}{file_name}')
-
-    # Get the play start times.
-    play_starts = ngs_df.groupby(['Season_Year', 'GameKey', 'PlayID']).agg({'Time':'min'})
-    play_starts.reset_index(inplace=True)
-    play_starts.rename(index=str, columns={'Time':'Play_StartTime'}, inplace=True)
-
-    # Stick the start times back on the rest of the NGS data.
-    ngs_df = ngs_df.merge(play_starts, how='outer',
-                          left_on=['Season_Year', 'GameKey', 'PlayID'],
-                          right_on=['Season_Year', 'GameKey', 'PlayID'])
-    ngs_df.loc[:, 'Time'] = pd.to_datetime(ngs_df.Time)
-    ngs_df.loc[:, 'Play_StartTime'] = pd.to_datetime(ngs_df.Play_StartTime)
-    ngs_df.loc[:, 'Relative_Time'] = ngs_df.Time - ngs_df.Play_StartTime
-    ngs_df.loc[:, 't'] = [x.total_seconds() for x in ngs_df.Relative_Time.tolist()]
-    ngs_df.drop(['Play_StartTime', 'Relative_Time'], axis=1, inplace=True)
+    ngs_df = read_raw_ngs(file_name)
 
-    return ngs_df
+    return add_relative_times(ngs_df)
+
+def iter_play_chunks(file_name, max_plays=500, chunksize=200000, shard=None):
+    """
+    Read an NGS dataset in chunks, yielding DataFrames that hold whole plays
+    only (at most max_plays of them). Rows belonging to a play that runs past
+    the end of a chunk are carried over to the next one.
+
+    This assumes that the rows for a play are contiguous in the file and that
+    plays are sorted by key, which is the case for the raw NGS-*.csv files. A
+    ValueError is raised if a play turns up out of order (see
+    _check_play_order).
+
+    Parameters:
+        file_name: str
+            Name of NGS dataset.
+        max_plays: int (default 500)
+            Maximum number of plays held in a yielded DataFrame (this is what
+            bounds peak memory).
+        chunksize: int (default 200000)
+            Number of rows read from the file at a time.
+        shard: tuple or list (default None)
+            Part of the dataset to read (see read_raw_ngs).
+    """
+
+    carry_df, last_key = None, None
+    reader = read_raw_ngs(file_name, shard=shard, chunksize=chunksize)
+
+    for chunk in reader:
+        if carry_df is not None:
+            chunk = pd.concat([carry_df, chunk], ignore_index=True)
+
+        # Number the plays in the buffer. The last one might still be going,
+        # so hold it back until we've seen the next chunk.
+        play_num = np.cumsum(_group_starts(chunk, PLAY_COLS)) - 1
+        last_play = play_num[-1]
+
+        carry_df = chunk.loc[play_num == last_play].reset_index(drop=True)
+        chunk = chunk.loc[play_num < last_play]
+        play_num = play_num[play_num < last_play]
+        last_key = _check_play_order(chunk, last_key)
+
+        # Emit complete plays, max_plays at a time.
+        for first_play in range(0, last_play, max_plays):
+            in_batch = (play_num >= first_play) & (play_num < first_play + max_plays)
+            yield chunk.loc[in_batch].reset_index(drop=True)
+
+    if carry_df is not None and len(carry_df):
+        _check_play_order(carry_df, last_key)
+        yield carry_df
+
+def stream_dynamics(file_name, out_file, max_plays=500, chunksize=200000,
+                    deriv_opts=None, shard=None, timeline_file=None):
+    """
+    Streaming version of get_relative_times + compute_dynamics. The NGS dataset
+    is processed a few plays at a time and written to out_file as we go, so
+    memory use depends on max_plays rather than on the size of the file.
+
+    Parameters:
+        file_name: str
+            Name of NGS dataset.
+        out_file: str
+            Path of output file (overwritten).
+        max_plays: int (default 500)
+            Maximum number of plays held in memory at once.
+        chunksize: int (default 200000)
+            Number of rows read from the file at a time.
+        deriv_opts: dict (default None)
+            Keyword arguments for compute_dynamics (method, window, order).
+        shard: tuple or list (default None)
+            Part of the dataset to process (see read_raw_ngs).
+        timeline_file: str (default None)
+            Path of event timeline output file (overwritten; see
+            event_timeline.py). None skips the timeline.
+    """
+
+    deriv_opts = deriv_opts or {}
+    n_rows = 0
+    header = True
+
+    for play_df in iter_play_chunks(file_name, max_plays=max_plays,
+                                    chunksize=chunksize, shard=shard):
+        play_df = compute_dynamics(add_relative_times(play_df), **deriv_opts)
+        play_df.to_csv(out_file, mode='w' if header else 'a', header=header,
+                       index=False)
+
+        # Batches hold whole plays, so their timelines can just be stacked.
+        if timeline_file is not None:
+            sorted_event_timeline(play_df).to_csv(timeline_file, mode='w' if header else 'a',
+                                                  header=header, index=False)
+
+        n_rows += len(play_df)
+        header = False
+
+    return n_rows
+
+def process_ngs_shard(file_name, shard, part_file, stream=False, max_plays=500,
+                      deriv_opts=None, timeline_part=None):
+    """
+    Add relative time and velocity/acceleration to one shard of an NGS dataset
+    (see plan_shards), saving the result to part_file (and its event timeline
+    to timeline_part). Returns the number of rows written and the time taken.
+
+    Parameters:
+        file_name: str
+            Name of NGS dataset.
+        shard: tuple or list
+            Part of the dataset to process (see read_raw_ngs). None processes
+            the whole dataset.
+        part_file: str
+            Path of output file (overwritten).
+        stream: bool (default False)
+            Boolean indicating whether to process the shard a few plays at a
+            time (see stream_dynamics).
+        max_plays: int (default 500)
+            Maximum number of plays held in memory at once (stream only).
+        deriv_opts: dict (default None)
+            Keyword arguments for compute_dynamics (method, window, order).
+        timeline_part: str (default None)
+            Path of event timeline output file (overwritten). None skips the
+            timeline.
+    """
+
+    deriv_opts = deriv_opts or {}
+    start = time.time()
+
+    try:
+        if stream:
+            n_rows = stream_dynamics(file_name, part_file, max_plays=max_plays,
+                                     deriv_opts=deriv_opts, shard=shard,
+                                     timeline_file=timeline_part)
+        else:
+            # Plays can't be split across shards (see plan_shards).
+            raw_df = read_raw_ngs(file_name, shard=shard)
+            if shard is not None:
+                _check_play_order(raw_df)
+            ss_data = compute_dynamics(add_relative_times(raw_df), **deriv_opts)
+            ss_data.to_csv(part_file, index=False)
+            if timeline_part is not None:
+                sorted_event_timeline(ss_data).to_csv(timeline_part, index=False)
+            n_rows = len(ss_data)
+    except BaseException:
+        for x in [part_file, timeline_part]:
+            if x is not None and os.path.exists(x):
+                os.remove(x)
+        raise
+
+    return n_rows, time.time() - start
+
+def join_parts(part_files, out_file):
+    """
+    Concatenate CSVs with the same columns (keeping only the first header)
+    into out_file, via a temporary file, and delete them. Missing parts (e.g.,
+    shards without any plays) are skipped.
+
+    Parameters:
+        part_files: list (str)
+            Paths to CSVs, in order.
+        out_file: str
+            Path of output file (overwritten).
+    """
+
+    tmp_file = os.path.join(os.path.dirname(out_file), f'.{os.path.basename(out_file)}.tmp')
+    header = None
+
+    with open(tmp_file, 'wb') as out:
+        for part_file in part_files:
+            if not os.path.exists(part_file):
+                continue
+
+            with open(part_file, 'rb') as f:
+                part_header = f.readline()
+                if header is None:
+                    header = part_header
+                    out.write(header)
+                shutil.copyfileobj(f, out)
+
+    os.replace(tmp_file, out_file)
+
+    for part_file in part_files:
+        if os.path.exists(part_file):
+            os.remove(part_file)
+
+def process_ngs_file(file_name, stream=False, max_plays=500, deriv_opts=None):
+    """
+    Add relative time and velocity/acceleration to a whole NGS dataset (as a
+    single shard - see process_ngs_shard) and save the result to ODIR, along
+    with its event timeline (see event_timeline.py). Both are moved into place
+    with join_parts once they're done, data first, so a crashed/killed run
+    never leaves a partial file behind and the timeline is never older than
+    the data.
+
+    Parameters:
+        file_name: str
+            Name of NGS dataset.
+        stream: bool (default False)
+            Boolean indicating whether to process the file a few plays at a
+            time (see stream_dynamics) rather than all at once.
+        max_plays: int (default 500)
+            Maximum number of plays held in memory at once (stream only).
+        deriv_opts: dict (default None)
+            Keyword arguments for compute_dynamics (method, window, order).
+    """
+
+    out_file = f'{ODIR}{file_name}'
+    part_file = f'{ODIR}.{file_name}.part.tmp'
+    tl_part = timeline_path(part_file)
+    os.makedirs(os.path.dirname(tl_part), exist_ok=True)
+
+    n_rows, elapsed = process_ngs_shard(file_name, None, part_file, stream=stream,
+                                        max_plays=max_plays, deriv_opts=deriv_opts,
+                                        timeline_part=tl_part)
+    join_parts([part_file], out_file)
+    join_parts([tl_part], timeline_path(out_file))
+
+    return file_name, n_rows, elapsed
+
+def run_batch(files, n_workers=None, stream=False, max_plays=500,
+              deriv_opts=None, force=False, shard_bytes=SHARD_BYTES,
+              shard_rows=SHARD_ROWS):
+    """
+    Process a set of NGS datasets across a pool of worker processes, reporting
+    throughput as files finish. Each file is split into GameKey-range shards
+    of roughly equal size (see plan_shards), so one large regular-season file
+    is spread over several workers rather than holding up the whole batch.
+    The shards of a file are joined (in file order) and moved into place once
+    they're all done, followed by the file's event timeline (see
+    event_timeline.py), so the timeline is never older than the data. Files
+    whose outputs are still valid according to the manifest in ODIR (same
+    input contents, derivative options, and code) are skipped. The manifest
+    is only used when reading straight from the CSVs (not with USE_STORE).
+
+    Parameters:
+        files: list (str)
+            Names of NGS datasets.
+        n_workers: int (default None)
+            Number of worker processes (None uses all cores).
+        stream: bool (default False)
+            Passed through to process_ngs_shard.
+        max_plays: int (default 500)
+            Passed through to process_ngs_shard.
+        deriv_opts: dict (default None)
+            Passed through to process_ngs_shard.
+        force: bool (default False)
+            Boolean indicating whether to rebuild every file, even if its
+            output is up to date.
+        shard_bytes: int (default SHARD_BYTES)
+            Passed through to plan_shards.
+        shard_rows: int (default SHARD_ROWS)
+            Passed through to plan_shards.
+    """
+
+    start = time.time()
+    total_rows = 0
+    report = RunReport('preprocess_ngs_data')
+
+    # Figure out which files actually need to be (re)built (only when reading
+    # straight from the CSVs).
+    manifest = Manifest(f'{ODIR}manifest.json')
+    code = code_version(__file__, ngs_schema.__file__, event_timeline.__file__)
+    params = deriv_opts or {}
+    track = not USE_STORE
+
+    def _files(fn):
+        return [f'{WDIR}{fn}'], [f'{ODIR}{fn}', timeline_path(f'{ODIR}{fn}')]
+
+    todo = []
+    for fn in files:
+        if track and not force and manifest.is_current('preprocess_ngs_data',
+                                                       *_files(fn), params=params,
+                                                       code=code):
+            print(f'{fn}: up to date')
+            report['preprocess'].skip('up_to_date')
+        else:
+            todo.append(fn)
+
+    # Split each file into shards (one task each).
+    os.makedirs(os.path.dirname(timeline_path(ODIR)), exist_ok=True)
+    tasks, pending = [], {}
+    for fn in todo:
+        shards = plan_shards(fn, shard_bytes=shard_bytes, shard_rows=shard_rows)
+        parts = [f'{ODIR}.{fn}.part{i:04d}.tmp' for i in range(len(shards))]
+        tl_parts = [timeline_path(x) for x in parts]
+
+        pending[fn] = {'parts': parts, 'tl_parts': tl_parts, 'left': len(shards),
+                       'rows': 0, 'time': 0., 'error': None}
+        tasks += list(zip([fn]*len(shards), shards, parts, tl_parts))
+
+    with report.stage('preprocess') as stage, \
+         ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = {pool.submit(process_ngs_shard, fn, shard, part, stream,
+                               max_plays, deriv_opts, tl_part): fn
+                   for fn, shard, part, tl_part in tasks}
+
+        for future in as_completed(futures):
+            fn = futures[future]
+            state = pending[fn]
+            state['left'] -= 1
+
+            try:
+                n_rows, elapsed = future.result()
+                state['rows'] += n_rows
+                state['time'] += elapsed
+            except Exception as err:
+                state['error'] = state['error'] or err
+
+            if state['left']:
+                continue
+
+            # All shards are in - join them (or clean up if any failed).
+            if state['error'] is not None:
+                print(f'{fn}: failed ({state["error"]!r})')
+                stage.fail(type(state['error']).__name__)
+                for part in state['parts'] + state['tl_parts']:
+                    if os.path.exists(part):
+                        os.remove(part)
+                continue
+
+            join_parts(state['parts'], f'{ODIR}{fn}')
+            join_parts(state['tl_parts'], timeline_path(f'{ODIR}{fn}'))
+            if track:
+                manifest.record('preprocess_ngs_data', *_files(fn), params=params,
+                                code=code)
+
+            # Throughput is per worker (time summed over the file's shards).
+            n_rows, file_elapsed = state['rows'], state['time']
+            total_rows += n_rows
+            stage.rows(n_out=n_rows)
+            stage.process()
+            print(f'{fn}: {n_rows} rows ({len(state["parts"])} shards) in '
+                  f'{file_elapsed:.1f} s ({n_rows/max(file_elapsed, 1e-9):,.0f} rows/s), '
+                  f'done after {time.time() - start:.1f} s')
+
+    elapsed = time.time() - start
+    print(f'Total: {total_rows} rows in {elapsed:.1f} s '
+          f'({total_rows/max(elapsed, 1e-9):,.0f} rows/s)')
+    report.write()
+
+    return total_rows
 
 if __name__ == '__main__':
 
@@ -115,14 +752,10 @@ if __name__ == '__main__':
     fs_data = get_relative_times(FILE)
     ss_data = compute_dynamics(fs_data)
 
+    # For files that don't fit in memory, stream a few plays at a time instead.
+    #stream_dynamics(FILE, f'{ODIR}{FILE}', max_plays=500)
+
     # Step through all NGS data, adding velocity/acceleration.
     #files = glob.glob(f'{WDIR}NGS*.csv')
     #files = [os.path.basename(x) for x in files]
-
-    #for fn in files:
-    #    print(fn)
-    #    fs_data = get_relative_times(fn)
-    #    ss_data = compute_dynamics(fs_data)
-
-    #    ss_data.to_csv(f'{ODIR}{fn}', index=False)
-    #    print('Done!')
+    #run_batch(files, n_workers=4, deriv_opts={'method': 'savgol', 'window': 7})
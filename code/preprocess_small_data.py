@@ -5,13 +5,70 @@
 # Last Modified: 12/2018
 
 ## IMPORTS
+import os
+import re
+import glob
+import json
+import pickle
 import numpy as np
 import pandas as pd
 
+from collections.abc import MutableMapping
+from manifest import code_version, file_digest, params_version
+from value_parsers import ParseCache, parse_unique
+
 
 ## VARIABLES
 WDIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/data/'
 
+# Source CSVs (in WDIR) for load_data.
+SOURCE_FILES = {
+    'game_data': 'game_data.csv',
+    'play_info': 'play_information.csv',
+    'play_role': 'play_player_role_data.csv',
+    'punt_data': 'player_punt_data.csv',
+    'video_injury': 'video_footage-injury.csv',
+    'video_control': 'video_footage-control.csv',
+    'video_review': 'video_review.csv'
+}
+
+# Tables built from other tables when preprocessing (see LazyData).
+TABLE_DEPS = {
+    'video_injury': ['video_review', 'punt_data', 'play_role']
+}
+
+# Snapshots of the tables from load_data, keyed by the hashes of the source
+# CSVs (see LazyData).
+SNAPSHOT_DIR = f'{WDIR}cache/load_data/'
+MAX_SNAPSHOT_BYTES = 512 * (1 << 20)
+
+# Punt outcomes (see collect_outcomes), in order of priority - each entry is a
+# phrase to look for in the (lowercased) PlayDescription and the outcome it
+# indicates. Plays that don't match anything are labeled DEFAULT_OUTCOME.
+OUTCOME_RULES = [
+    ('touchback', 'touchback'),
+    ('fair catch', 'fair catch'),
+    ('out of bounds', 'out of bounds'),
+    ('muff', 'muffed punt'),
+    ('downed', 'downed'),
+    ('no play', 'no play'),
+    ('blocked', 'blocked punt'),
+    ('fumble', 'fumble'),
+    ('pass', 'pass'),
+    ('declined', 'declined penalty'),
+    ('direct snap', 'direct snap'),
+    ('safety', 'safety'),
+    ('punts', 'return')
+]
+DEFAULT_OUTCOME = 'SPECIAL'
+
+# Patterns for pulling features out of PlayDescription (see
+# expand_play_description).
+PUNT_DISTANCE_RE = re.compile(r'punts (.*?)yard') # text between "punts " and "yard"
+POST_PUNT_YARDLINE_RE = re.compile(r'^[^,]*?to ((?:(?!to )[^,])*)') # first "to ..." before a comma
+
+PARSE_CACHE = f'{WDIR}cache/parsed_values.json' # see value_parsers.py
+
 
 ## FUNCTIONS
 def collect_outcomes(data):
@@ -25,58 +82,60 @@ def collect_outcomes(data):
 
     play_info =  data['play_info']
 
-    def _process_description(row):
-        tmp_desc = row.PlayDescription
-        outcome = ''
-
-        if 'touchback' in tmp_desc.lower():
-            outcome = 'touchback'
-        elif 'fair catch' in tmp_desc.lower():
-            outcome = 'fair catch'
-        elif 'out of bounds' in tmp_desc.lower():
-            outcome = 'out of bounds'
-        elif 'muff' in tmp_desc.lower():
-            outcome = 'muffed punt'
-        elif 'downed' in tmp_desc.lower():
-            outcome = 'downed'
-        elif 'no play' in tmp_desc.lower():
-            outcome = 'no play'
-        elif 'blocked' in tmp_desc.lower():
-            outcome = 'blocked punt'
-        elif 'fumble' in tmp_desc.lower():
-            outcome = 'fumble'
-        elif 'pass' in tmp_desc.lower():
-            outcome = 'pass'
-        elif 'declined' in tmp_desc.lower():
-            outcome = 'declined penalty'
-        elif 'direct snap' in tmp_desc.lower():
-            outcome = 'direct snap'
-        elif 'safety' in tmp_desc.lower():
-            outcome = 'safety'
-        else:
-            if 'punts' in tmp_desc.lower():
-                outcome = 'return'
-            else:
-                outcome = 'SPECIAL'
-
-        return outcome
-
-    play_info.loc[:, 'Punt_Outcome'] = play_info.apply(_process_description, axis=1)
-
-    def _identify_penalties(row):
-        if 'penalty' in row.PlayDescription.lower():
-            return 1
-        else:
-            return 0
-
-    play_info.loc[:, 'Penalty_on_Punt'] = play_info.apply(_identify_penalties, axis=1)
+    # Lowercase descriptions once, then check each rule (first match wins).
+    desc = play_info.PlayDescription.str.lower()
+
+    matches = [desc.str.contains(pattern, regex=False, na=False)
+               for pattern, _ in OUTCOME_RULES]
+    outcomes = [outcome for _, outcome in OUTCOME_RULES]
+
+    play_info.loc[:, 'Punt_Outcome'] = np.select(matches, outcomes, default=DEFAULT_OUTCOME)
+    penalty = desc.str.contains('penalty', regex=False, na=False)
+    play_info.loc[:, 'Penalty_on_Punt'] = penalty.astype(int)
 
     # Update dictionary to include additional set of features.
     data.update({'play_info': play_info})
 
     return data
 
-def expand_play_description(data):
+def _field_side(yard_line):
+    # "SEA 35" -> "SEA"
+    return yard_line.split(' ')[0]
+
+def _pre_punt_yard_line(poss_team, yard_line):
+    # Yard line relative to the punting team's goal line.
+    field_position = int(yard_line.split(' ')[1])
+
+    return field_position if poss_team in yard_line else 100 - field_position
+
+def _post_punt_yard_line(post_yard_line, own_field):
+    # Yard line after the punt relative to the punting team's goal line (-999
+    # if it can't be worked out).
+    if 'end zone' in post_yard_line:
+        return 0
+    elif '50' in post_yard_line:
+        return 50
+
+    try:
+        field_position = int(post_yard_line.split(' ')[1])
+    except (IndexError, ValueError):
+        return -999
+
+    return 100 - field_position if not own_field else field_position
+
+def _split_pair(pair):
+    # "NE-MIA" -> ("NE", "MIA")
+    parts = pair.split('-')
+
+    return parts[0], parts[1]
+
+def _split_score(score):
+    # "7 - 3" -> (7, 3)
+    parts = score.split('-')
+
+    return int(parts[0]), int(parts[1])
+
+def expand_play_description(data, cache=None):
     """
     Expand the PlayDescription field in a standardized fashion. This function
     extracts a number of relevant additional features from PlayDescription,
@@ -86,117 +145,119 @@ def expand_play_description(data):
     Parameters:
         data: dict (keys: labels, values: DataFrames)
             Data dictionary - likely the output from load_data().
+        cache: ParseCache (default None)
+            Cache of previously parsed values (see value_parsers.py).
     """
 
     play_info = data['play_info']
-
-    def _split_punt_distance(row):
-        try:
-            return int(row.PlayDescription.split('punts ')[1].split('yard')[0])
-        except IndexError:
-            return np.nan
-
-    def _split_field_position(row):
-        try:
-            return row.PlayDescription.split(',')[0].split('to ')[1]
-        except IndexError:
-            return ''
-
-    def _post_punt_territory(row):
-        if row.Poss_Team == row.Post_Punt_FieldSide:
-            return 0
-        else:
-            return 1
-
-    def _start_punt_field_position(row):
-        try:
-            field_position = int(row.YardLine.split(' ')[1])
-        except:
-            print(row.YardLine)
-
-        if row.Poss_Team in row.YardLine:
-            return field_position
-        else:
-            return 100 - field_position
-
-    def _field_position_punt(row):
-        if 'end zone' in row.Post_Punt_YardLine:
-            return 0
-        elif '50' in row.Post_Punt_YardLine:
-            return 50
-        else:
-            try:
-                yard_line = int(row.Post_Punt_YardLine.split(' ')[1])
-                own_field = int(row.Post_Punt_Own_Territory)
-
-                if not own_field:
-                    return 100 - yard_line
-                else:
-                    return yard_line
-            except:
-                return -999
-
-    play_info.loc[:, 'Punt_Distance'] = play_info.apply(_split_punt_distance, axis=1)
-    play_info.loc[:, 'Post_Punt_YardLine'] = play_info.apply(_split_field_position, axis=1)
-    play_info.loc[:, 'Post_Punt_FieldSide'] = play_info.Post_Punt_YardLine.apply(lambda x: x.split(' ')[0])
-    play_info.loc[:, 'Post_Punt_Own_Territory'] = play_info.apply(_post_punt_territory, axis=1)
-    play_info.loc[:, 'Pre_Punt_RelativeYardLine'] = play_info.apply(_start_punt_field_position, axis=1)
-    play_info.loc[:, 'Post_Punt_RelativeYardLine'] = play_info.apply(_field_position_punt, axis=1)
+    desc = play_info.PlayDescription
+
+    # Punt distance ("... punts 45 yards to ..."), nan if nobody punted.
+    punt_dist = pd.to_numeric(desc.str.extract(PUNT_DISTANCE_RE, expand=False).str.strip())
+    if punt_dist.notnull().all():
+        punt_dist = punt_dist.astype(int)
+    play_info.loc[:, 'Punt_Distance'] = punt_dist
+
+    # Where the punt ended up (e.g., "NE 35", "end zone"), '' if unknown.
+    play_info.loc[:, 'Post_Punt_YardLine'] = desc.str.extract(POST_PUNT_YARDLINE_RE, expand=False).fillna('')
+    play_info.loc[:, 'Post_Punt_FieldSide'] = parse_unique(play_info.Post_Punt_YardLine,
+                                                          _field_side, cache=cache)
+    play_info.loc[:, 'Post_Punt_Own_Territory'] = np.where(
+        play_info.Poss_Team == play_info.Post_Punt_FieldSide, 0, 1)
+
+    # Field position before/after the punt (relative to the punting team's goal
+    # line), -999 if it can't be worked out after the punt. These only depend
+    # on a handful of distinct values, so each is parsed once (see
+    # value_parsers.py).
+    play_info.loc[:, 'Pre_Punt_RelativeYardLine'] = parse_unique(
+        play_info.loc[:, ['Poss_Team', 'YardLine']], _pre_punt_yard_line, cache=cache)
+    play_info.loc[:, 'Post_Punt_RelativeYardLine'] = parse_unique(
+        play_info.loc[:, ['Post_Punt_YardLine', 'Post_Punt_Own_Territory']],
+        _post_punt_yard_line, cache=cache)
 
     # Extract additional information from play info (home team, away team, score
     # differential, home/away punt identifier).
-    play_info.loc[:, 'Home_Team'] = play_info.Home_Team_Visit_Team.apply(lambda x: x.split('-')[0])
-    play_info.loc[:, 'Away_Team'] = play_info.Home_Team_Visit_Team.apply(lambda x: x.split('-')[1])
-    play_info.loc[:, 'Home_Points'] = play_info.Score_Home_Visiting.apply(lambda x: x.split('-')[0]).astype(int)
-    play_info.loc[:, 'Away_Points'] = play_info.Score_Home_Visiting.apply(lambda x: x.split('-')[1]).astype(int)
+    teams = parse_unique(play_info.Home_Team_Visit_Team, _split_pair,
+                         columns=['Home_Team', 'Away_Team'], cache=cache)
+    points = parse_unique(play_info.Score_Home_Visiting, _split_score,
+                          columns=['Home_Points', 'Away_Points'], cache=cache)
 
-    def _home_away_punt_bool(row):
-        if row.Home_Team == row.Poss_Team:
-            return 1
-        else:
-            return 0
+    for col in ['Home_Team', 'Away_Team']:
+        play_info.loc[:, col] = teams[col]
+    for col in ['Home_Points', 'Away_Points']:
+        play_info.loc[:, col] = points[col]
 
-    play_info.loc[:, 'Home_Visit_Team_Punt'] = play_info.apply(_home_away_punt_bool, axis=1)
+    home_punt = (play_info.Home_Team == play_info.Poss_Team).values
+    score_diff = (play_info.Home_Points - play_info.Away_Points).values
 
-    def _get_score_differential(row):
-        if not row.Home_Visit_Team_Punt:
-            return int(row.Away_Points - row.Home_Points)
-        else:
-            return int(row.Home_Points - row.Away_Points)
-
-    play_info.loc[:, 'Score_Differential'] = play_info.apply(_get_score_differential, axis=1)
+    play_info.loc[:, 'Home_Visit_Team_Punt'] = home_punt.astype(int)
+    play_info.loc[:, 'Score_Differential'] = np.where(home_punt, score_diff, -score_diff)
 
     # Update dictionary to include additional set of features.
     data.update({'play_info': play_info})
 
     return data
 
-def load_data(raw_bool=False):
+def _source_digests(snap_dir, labels):
+    # SHA-1 of a set of source CSVs. Hashes are kept in an index next to the
+    # snapshots and only recomputed when a file's size/mtime change.
+    index_file = f'{snap_dir}digests.json'
+    index = {}
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+
+    digests, changed = {}, False
+
+    for label in labels:
+        path = f'{WDIR}{SOURCE_FILES[label]}'
+        st = os.stat(path)
+        known = index.get(path, {})
+
+        if known.get('size') != st.st_size or known.get('mtime_ns') != st.st_mtime_ns:
+            known = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': file_digest(path)}
+            index[path], changed = known, True
+
+        digests[label] = known['sha1']
+
+    if changed:
+        tmp_path = f'{index_file}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, index_file)
+
+    return digests
+
+def _prune_snapshots(snap_dir, max_bytes):
+    # Drop least recently used snapshots until the directory fits in
+    # max_bytes (the most recent one is always kept).
+    snaps = sorted(glob.glob(f'{snap_dir}*.pkl'), key=os.path.getmtime, reverse=True)
+    total = 0
+
+    for i, path in enumerate(snaps):
+        total += os.path.getsize(path)
+        if i > 0 and total > max_bytes:
+            os.remove(path)
+
+def _read_table(name, raw_bool=False):
     """
-    When called, this function will load in all of the data and do the relevant
-    preprocessing (mainly just a series of merges to link the injury data with a
-    few of the other data sources). The output of this function is a dictionary
-    with key/value pairs that are labels/DataFrames, respectively.
+    Read a single table and do the preprocessing that only involves that
+    table (renaming columns to a common format, dropping duplicates).
 
     Parameters:
+        name: str
+            Table name (see SOURCE_FILES).
         raw_bool: bool (default False)
             Boolean indicating whether you wish to perform the necessary
             preprocessing steps (False) or not (True).
     """
 
-    # Load data.
-    game_data = pd.read_csv(f'{WDIR}game_data.csv')
-    play_info = pd.read_csv(f'{WDIR}play_information.csv')
-    play_role = pd.read_csv(f'{WDIR}play_player_role_data.csv')
-    punt_data = pd.read_csv(f'{WDIR}player_punt_data.csv')
-
-    video_injury = pd.read_csv(f'{WDIR}video_footage-injury.csv')
-    video_review = pd.read_csv(f'{WDIR}video_review.csv')
-    video_control = pd.read_csv(f'{WDIR}video_footage-control.csv')
+    table = pd.read_csv(f'{WDIR}{SOURCE_FILES[name]}')
 
     if raw_bool:
-        pass
-    else:
+        return table
+
+    if name in ['video_injury', 'video_control']:
         # Rename columns to match format (between video_injury/video_control and
         # everything else).
         ren_dict = {
@@ -207,70 +268,219 @@ def load_data(raw_bool=False):
             'playid': 'PlayId'
         }
 
-        video_injury.rename(index=str, columns=ren_dict, inplace=True)
-        video_control.rename(index=str, columns=ren_dict, inplace=True)
-        video_review.rename(index=str, columns={'PlayID':'PlayId'}, inplace=True)
-
-        # Join video_review to video_injury.
-        video_injury = video_injury.merge(video_review, how='outer',
-                                          left_on=['Season_Year', 'GameKey', 'PlayId'],
-                                          right_on=['Season_Year', 'GameKey', 'PlayId'])
-
-        # Process punt_data - it's possible to have multiple numbers for the same
-        # player, so we'll drop number to get rid of duplicates.
-        punt_data.drop('Number', axis=1, inplace=True)
-        punt_data.drop_duplicates(inplace=True)
-
-        # Add player primary position to video_injury.
-        video_injury = video_injury.merge(punt_data, how='inner', on=['GSISID'])
-        video_injury.rename(index=str, columns={'Position':'Player_Position'},
-                            inplace=True)
-
-        # Fix a few values in Primary_Partner_GSISID that will cause the next
-        # merge to barf (one nan, one 'Unclear').
-        video_injury.replace(to_replace={'Primary_Partner_GSISID':'Unclear'},
-                             value=99999, inplace=True)
-        video_injury.replace(to_replace={'Primary_Partner_GSISID':np.nan},
-                             value=99999, inplace=True)
-        video_injury.loc[:, 'Primary_Partner_GSISID'] = video_injury.Primary_Partner_GSISID.astype(int)
-
-        # Add primary partner primary position to video_injury.
-        video_injury = video_injury.merge(punt_data, how='left',
-                                          left_on=['Primary_Partner_GSISID'],
-                                          right_on=['GSISID'])
-        video_injury.drop('GSISID_y', axis=1, inplace=True)
-        video_injury.rename(index=str, columns={'GSISID_x':'GSISID'}, inplace=True)
-        video_injury.rename(index=str, columns={'Position':'Primary_Partner_Position'},
-                            inplace=True)
-
-        # Add punt specific play role for players to video_injury.
-        play_role.rename(index=str, columns={'PlayID':'PlayId'}, inplace=True)
-        video_injury = video_injury.merge(play_role, how='left',
-                                          left_on=['Season_Year', 'GameKey', 'PlayId', 'GSISID'],
-                                          right_on=['Season_Year', 'GameKey', 'PlayId', 'GSISID'])
-        video_injury.rename(index=str, columns={'Role':'Player_Punt_Role'}, inplace=True)
-
-        # Add punt specific play role for primary partners to video_injury.
-        video_injury = video_injury.merge(play_role, how='left',
-                                          left_on=['Season_Year', 'GameKey', 'PlayId', 'Primary_Partner_GSISID'],
-                                          right_on=['Season_Year', 'GameKey', 'PlayId', 'GSISID'])
-        video_injury.drop('GSISID_y', axis=1, inplace=True)
-        video_injury.rename(index=str, columns={'GSISID_x':'GSISID'}, inplace=True)
-        video_injury.rename(index=str, columns={'Role':'Primary_Partner_Punt_Role'},
-                            inplace=True)
-
-    # Stick everything in a dictionary to return as output.
-    out_dict = {
-        'game_data': game_data,
-        'play_info': play_info,
-        'play_role': play_role,
-        'punt_data': punt_data,
-        'video_injury': video_injury,
-        'video_control': video_control,
-        'video_review': video_review
-    }
-
-    return out_dict
+        table.rename(index=str, columns=ren_dict, inplace=True)
+    elif name in ['video_review', 'play_role']:
+        table.rename(index=str, columns={'PlayID':'PlayId'}, inplace=True)
+    elif name == 'punt_data':
+        # It's possible to have multiple numbers for the same player, so we'll
+        # drop number to get rid of duplicates.
+        table.drop('Number', axis=1, inplace=True)
+        table.drop_duplicates(inplace=True)
+
+    return table
+
+def _build_video_injury(video_injury, video_review, punt_data, play_role):
+    """
+    Link the injury data with a few of the other data sources (video review,
+    player positions, punt roles). None of the inputs are modified.
+
+    Parameters:
+        video_injury: pd.DataFrame
+            Injury video footage (see _read_table).
+        video_review: pd.DataFrame
+            Video review data (see _read_table).
+        punt_data: pd.DataFrame
+            Player positions (see _read_table).
+        play_role: pd.DataFrame
+            Player punt roles (see _read_table).
+    """
+
+    # Join video_review to video_injury.
+    video_injury = video_injury.merge(video_review, how='outer',
+                                      left_on=['Season_Year', 'GameKey', 'PlayId'],
+                                      right_on=['Season_Year', 'GameKey', 'PlayId'])
+
+    # Add player primary position to video_injury.
+    video_injury = video_injury.merge(punt_data, how='inner', on=['GSISID'])
+    video_injury.rename(index=str, columns={'Position':'Player_Position'},
+                        inplace=True)
+
+    # Fix a few values in Primary_Partner_GSISID that will cause the next
+    # merge to barf (one nan, one 'Unclear').
+    video_injury.replace(to_replace={'Primary_Partner_GSISID':'Unclear'},
+                         value=99999, inplace=True)
+    video_injury.replace(to_replace={'Primary_Partner_GSISID':np.nan},
+                         value=99999, inplace=True)
+    video_injury.loc[:, 'Primary_Partner_GSISID'] = video_injury.Primary_Partner_GSISID.astype(int)
+
+    # Add primary partner primary position to video_injury.
+    video_injury = video_injury.merge(punt_data, how='left',
+                                      left_on=['Primary_Partner_GSISID'],
+                                      right_on=['GSISID'])
+    video_injury.drop('GSISID_y', axis=1, inplace=True)
+    video_injury.rename(index=str, columns={'GSISID_x':'GSISID'}, inplace=True)
+    video_injury.rename(index=str, columns={'Position':'Primary_Partner_Position'},
+                        inplace=True)
+
+    # Add punt specific play role for players to video_injury.
+    video_injury = video_injury.merge(play_role, how='left',
+                                      left_on=['Season_Year', 'GameKey', 'PlayId', 'GSISID'],
+                                      right_on=['Season_Year', 'GameKey', 'PlayId', 'GSISID'])
+    video_injury.rename(index=str, columns={'Role':'Player_Punt_Role'}, inplace=True)
+
+    # Add punt specific play role for primary partners to video_injury.
+    video_injury = video_injury.merge(play_role, how='left',
+                                      left_on=['Season_Year', 'GameKey', 'PlayId', 'Primary_Partner_GSISID'],
+                                      right_on=['Season_Year', 'GameKey', 'PlayId', 'GSISID'])
+    video_injury.drop('GSISID_y', axis=1, inplace=True)
+    video_injury.rename(index=str, columns={'GSISID_x':'GSISID'}, inplace=True)
+    video_injury.rename(index=str, columns={'Role':'Primary_Partner_Punt_Role'},
+                        inplace=True)
+
+    return video_injury
+
+class LazyData(MutableMapping):
+    """
+    Dictionary of tables (keys: labels, values: DataFrames) that reads each
+    table the first time it's accessed. Tables built from other tables (see
+    TABLE_DEPS) pull in their dependencies at that point, without adding them
+    to the dictionary. Built tables are snapshotted on disk, keyed by the
+    hashes of the source CSVs they depend on (compared by content), raw_bool,
+    and this file - so a warm load is just unpickling the table.
+
+    Tables can be replaced/added like in a regular dictionary (e.g., with
+    update()).
+
+    Parameters:
+        raw_bool: bool (default False)
+            Boolean indicating whether you wish to perform the necessary
+            preprocessing steps (False) or not (True).
+        use_cache: bool (default True)
+            Whether to read/write snapshots at all.
+        snap_dir: str (default SNAPSHOT_DIR)
+            Directory holding snapshots.
+        max_bytes: int (default MAX_SNAPSHOT_BYTES)
+            Maximum total size of snapshots kept in snap_dir.
+    """
+
+    def __init__(self, raw_bool=False, use_cache=True, snap_dir=SNAPSHOT_DIR,
+                 max_bytes=MAX_SNAPSHOT_BYTES):
+
+        self.raw_bool = raw_bool
+        self.use_cache = use_cache
+        self.snap_dir = snap_dir
+        self.max_bytes = max_bytes
+
+        self._keys = list(SOURCE_FILES)
+        self._tables = {}
+        self._code = code_version(__file__) if use_cache else None
+
+    @property
+    def loaded(self):
+        return [x for x in self._keys if x in self._tables]
+
+    def _deps(self, name):
+        return [] if self.raw_bool else TABLE_DEPS.get(name, [])
+
+    def _sources(self, name):
+        # Source CSVs that go into a table (including its dependencies).
+        sources = [name]
+        for dep in self._deps(name):
+            sources += [x for x in self._sources(dep) if x not in sources]
+
+        return sources
+
+    def _build(self, name):
+        if self.use_cache:
+            os.makedirs(self.snap_dir, exist_ok=True)
+
+            key = params_version({
+                'table': name,
+                'sources': _source_digests(self.snap_dir, self._sources(name)),
+                'raw_bool': bool(self.raw_bool),
+                'code': self._code,
+                'pandas': pd.__version__
+            })
+            snap_file = f'{self.snap_dir}{key}.pkl'
+
+            if os.path.exists(snap_file):
+                with open(snap_file, 'rb') as f:
+                    table = pickle.load(f)
+                os.utime(snap_file) # mark as recently used
+
+                return table
+
+        table = _read_table(name, raw_bool=self.raw_bool)
+        if self._deps(name):
+            table = _build_video_injury(table, *[self._build(x) for x in self._deps(name)])
+
+        if self.use_cache:
+            tmp_path = f'{snap_file}.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(table, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, snap_file)
+
+            _prune_snapshots(self.snap_dir, self.max_bytes)
+
+        return table
+
+    def __getitem__(self, name):
+        if name not in self._tables:
+            if name not in SOURCE_FILES or name not in self._keys:
+                raise KeyError(name)
+            self._tables[name] = self._build(name)
+
+        return self._tables[name]
+
+    def __setitem__(self, name, table):
+        if name not in self._keys:
+            self._keys.append(name)
+
+        self._tables[name] = table
+
+    def __delitem__(self, name):
+        if name not in self._keys:
+            raise KeyError(name)
+
+        self._keys.remove(name)
+        self._tables.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self._keys
+
+    def __iter__(self):
+        return iter(list(self._keys))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return f'LazyData(loaded={self.loaded}, keys={self._keys})'
+
+def load_data(raw_bool=False, use_cache=True, snap_dir=SNAPSHOT_DIR,
+              max_bytes=MAX_SNAPSHOT_BYTES):
+    """
+    When called, this function will set up loading for all of the data and the
+    relevant preprocessing (mainly just a series of merges to link the injury
+    data with a few of the other data sources). The output of this function is
+    a dictionary with key/value pairs that are labels/DataFrames, respectively
+    - each DataFrame is only read (and preprocessed) when it is first accessed
+    (see LazyData).
+
+    Parameters:
+        raw_bool: bool (default False)
+            Boolean indicating whether you wish to perform the necessary
+            preprocessing steps (False) or not (True).
+        use_cache: bool (default True)
+            Whether to read/write snapshots at all.
+        snap_dir: str (default SNAPSHOT_DIR)
+            Directory holding snapshots.
+        max_bytes: int (default MAX_SNAPSHOT_BYTES)
+            Maximum total size of snapshots kept in snap_dir.
+    """
+
+    return LazyData(raw_bool=raw_bool, use_cache=use_cache, snap_dir=snap_dir,
+                    max_bytes=max_bytes)
 
 def parse_penalties(play_info_df):
     """
@@ -307,9 +517,14 @@ if __name__ == '__main__':
     # a relevant set of data for video_injury.
     data_dict = load_data()
 
-    # Extract additional information from PlayDescription.
+    # Extract additional information from PlayDescription (parsed values are
+    # cached between runs).
+    cache = ParseCache(PARSE_CACHE)
+
     data_dict = collect_outcomes(data_dict)
-    data_dict = expand_play_description(data_dict)
+    data_dict = expand_play_description(data_dict, cache=cache)
+
+    cache.save()
 
     # Unpack the data dictionary into DataFrames that can be parsed.
     gd_df = data_dict['game_data']
@@ -5,7 +5,6 @@
 # Last Modified: 12/2018
 
 ## IMPORTS
-import sys
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
@@ -15,15 +14,23 @@ from plotly import tools
 import plotly.graph_objs as go
 from plotly.offline import download_plotlyjs, init_notebook_mode, plot, iplot
 
+from event_timeline import find_event_timeline, pair_window, player_events
+from instrument import RunReport
+from key_index import KeyIndex
+from ngs_schema import read_ngs_csv
+from trajectory_store import TrajectoryStore
+
 pd.set_option('display.max_rows', 5000)
 
 ## VARIABLES
 WDIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/data/'
+TDIR = f'{WDIR}trajectories/'
+USE_TRAJ_STORE = False # read plays from trajectory store (see trajectory_store.py)
 YD_TO_M = 0.9144 # multiplicative factor for converting yards to meters
 
 
 ## FUNCTIONS
-def make_va_subplot(play_df, part_df, plt_option=None):
+def make_va_subplot(play_df, part_df, plt_option=None, timeline=None):
     """
     This function generates a plotly figure that can be used to display NGS data
     (see below for a list of supported options).
@@ -40,43 +47,17 @@ def make_va_subplot(play_df, part_df, plt_option=None):
                 angles: plot orientation/direction as a function of time
                 polar_angles: plot orientation/direction as a function of time
                               on a polar plot (r is time, theta is angle)
+        timeline: EventTimeline (default None)
+            Event timeline for the injury data (see event_timeline.py). If not
+            given, events are found in play_df/part_df directly.
     """
 
-    # Figure out where the ball snap occurred and get the index so that we can
-    # discard all data prior to that instant.
-    try:
-        play_st = play_df.loc[play_df.Event == 'punt'].index[0]
-        part_st = part_df.loc[part_df.Event == 'punt'].index[0]
-    except IndexError:
-        try:
-            play_st = play_df.loc[play_df.Event == 'ball_snap'].index[0]
-            part_st = part_df.loc[part_df.Event == 'ball_snap'].index[0]
-        except IndexError:
-            play_st = play_df.index.min()
-            part_st = part_df.index.min()
-
-    # Figure out where the play "ended" so that we can discard all data after
-    # that. For simplicity, we assume that any concussion event would have occured
-    # prior to a penalty flag being thrown or within five seconds of a tackle.
-    try:
-        play_ei = play_df.loc[play_df.Event == 'penalty_flag'].index[0]
-        part_ei = play_df.loc[play_df.Event == 'penalty_flag'].index[0]
-    except IndexError:
-        try:
-            play_ei = play_df.loc[play_df.Event == 'tackle'].index[0] + 50
-            part_ei = part_df.loc[part_df.Event == 'tackle'].index[0] + 50
-
-            play_ps = play_df.loc[play_df.Event == 'play_submit'].index[0]
-            part_ps = part_df.loc[part_df.Event == 'play_submit'].index[0]
-
-            while play_ei > play_ps:
-                play_ei -= 10
-
-            while part_ei > part_ps:
-                part_ei -= 10
-        except IndexError:
-            play_ei = play_df.index.max()
-            part_ei = part_df.index.max()
+    # Figure out where the play started (punt/snap) and "ended" (penalty flag
+    # or shortly after the tackle) for both player and partner - see
+    # event_timeline.pair_window.
+    (play_st, play_ei), (part_st, part_ei) = pair_window(
+        player_events(play_df, timeline), player_events(part_df, timeline),
+        len(play_df), len(part_df))
 
     # Slice out the data that we actually need.
     play_df = play_df.iloc[play_st:play_ei]
@@ -340,48 +321,62 @@ def make_va_subplot(play_df, part_df, plt_option=None):
 ## MAIN
 if __name__ == '__main__':
 
-    # Load data.
-    inj_df = pd.read_csv(f'{WDIR}injury_ngs_data.csv')
+    # Keep track of where the time goes (see instrument.py).
+    report = RunReport('process_injury_data')
+
+    # Event timeline for the injury data (see event_timeline.py), if there's an
+    # up-to-date one (events are found in the plays themselves otherwise).
+    timeline = find_event_timeline(f'{WDIR}injury_ngs_data.csv')
 
-    inj_df.head()
+    if USE_TRAJ_STORE:
+        # Plays come straight out of the trajectory store.
+        store = TrajectoryStore(f'{TDIR}injury_ngs_data')
+        plays = (sing_df for _, sing_df in store.iter_plays())
+    else:
+        # Load data.
+        inj_df = read_ngs_csv(f'{WDIR}injury_ngs_data.csv')
 
-    # Add column for easy indexing.
-    merge_cols = ['Season_Year', 'GameKey', 'PlayID']
-    ind_df = inj_df.drop_duplicates(merge_cols).reset_index(drop=True)
-    ind_df.loc[:, 'eventIndex'] = ind_df.index.values
+        inj_df.head()
 
-    ind_df = ind_df.loc[:, ['eventIndex', 'Season_Year', 'GameKey', 'PlayID']]
-    inj_df = inj_df.merge(ind_df, how='outer', left_on=merge_cols, right_on=merge_cols)
+        # Index plays so that we can step through them.
+        merge_cols = ['Season_Year', 'GameKey', 'PlayID']
+        plays = (sing_df for _, sing_df in KeyIndex(inj_df, merge_cols))
 
     # Iterate through each play, exporting a figure each time.
     plt_opt = 'polar_angles'
     dyn_info = []
 
-    for play_idx in range(len(inj_df.eventIndex.unique())):
-        try:
-            sing_df = inj_df.loc[inj_df.eventIndex == play_idx]
-            play_df = sing_df.loc[sing_df.Identifier == 'PLAYER'].reset_index(drop=True)
-            part_df = sing_df.loc[sing_df.Identifier == 'PARTNER'].reset_index(drop=True)
-
-            # Grab some stuff for labeling saved figure.
-            sy = sing_df.Season_Year.values[0]
-            gk = sing_df.GameKey.values[0]
-            pi = sing_df.PlayID.values[0]
-
-            figure, dd = make_va_subplot(play_df, part_df, plt_option=plt_opt)
-            sys.exit()
-
-            # Add data dictionary to list.
-            dd['season_year'] = sy
-            dd['game_key'] = gk
-            dd['play_id'] = pi
-            dyn_info.append(dd)
-
-            # Save figure.
-            ODIR = f'/Users/cbonfield/Projects/kaggle/nfl_punts/figures/{plt_opt}/'
-            pio.write_image(figure, f'{ODIR}{plt_opt}_{sy}_{gk}_{pi}.pdf')
-        except TypeError:
-            continue
+    for sing_df in plays:
+        with report.stage('plot') as stage:
+            stage.rows(n_in=len(sing_df))
+
+            try:
+                play_df = sing_df.loc[sing_df.Identifier == 'PLAYER'].reset_index(drop=True)
+                part_df = sing_df.loc[sing_df.Identifier == 'PARTNER'].reset_index(drop=True)
+
+                # Grab some stuff for labeling saved figure.
+                sy = sing_df.Season_Year.values[0]
+                gk = sing_df.GameKey.values[0]
+                pi = sing_df.PlayID.values[0]
+
+                figure, dd = make_va_subplot(play_df, part_df, plt_option=plt_opt,
+                                             timeline=timeline)
+
+                # Add data dictionary to list.
+                dd['season_year'] = sy
+                dd['game_key'] = gk
+                dd['play_id'] = pi
+                dyn_info.append(dd)
+
+                # Save figure.
+                ODIR = f'/Users/cbonfield/Projects/kaggle/nfl_punts/figures/{plt_opt}/'
+                pio.write_image(figure, f'{ODIR}{plt_opt}_{sy}_{gk}_{pi}.pdf')
+                stage.process()
+            except TypeError:
+                stage.fail('TypeError')
+                continue
+
+    report.write()
 
     # Export DataFrame containing dynamic information.
     #dd_df = pd.DataFrame(dyn_info)
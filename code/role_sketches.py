@@ -0,0 +1,299 @@
+#
+# Quantile sketches for the summary dynamics (max speed/acceleration per
+# player/play), kept per punt role. Each sketch is a fixed-bin histogram, so
+# sketches built from different files (or by different workers) can simply be
+# added together, and percentiles for the whole league can be read off a few KB
+# of counts instead of loading every *-summary.csv.
+#
+# Author: Charlie Bonfield
+# Last Modified: 1/2019
+
+## IMPORTS
+import os
+import json
+import numpy as np
+
+## VARIABLES
+# Bin layout for each metric (lower edge, upper edge, number of bins), in
+# meters. Values outside the range are still counted (under/overflow).
+SKETCH_BINS = {
+    'max_vx': (-15., 15., 600),
+    'max_vy': (-15., 15., 600),
+    'max_s': (0., 20., 600),
+    'max_ax': (-50., 250., 600),
+    'max_ay': (-50., 250., 600),
+    'max_a': (0., 300., 600)
+}
+
+## FUNCTIONS
+class QuantileSketch:
+    """
+    Fixed-bin histogram that can answer (approximate) percentile queries and
+    be merged with other sketches that share the same bins.
+
+    Parameters:
+        lo: float
+            Lower edge of first bin.
+        hi: float
+            Upper edge of last bin.
+        n_bins: int
+            Number of bins.
+    """
+
+    def __init__(self, lo, hi, n_bins):
+
+        self.lo, self.hi, self.n_bins = float(lo), float(hi), int(n_bins)
+        self.counts = np.zeros(self.n_bins, dtype=np.int64)
+        self.under = 0
+        self.over = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def edges(self):
+        return np.linspace(self.lo, self.hi, self.n_bins+1)
+
+    @property
+    def count(self):
+        return int(self.counts.sum()) + self.under + self.over
+
+    def add(self, values):
+        """
+        Add a set of values to the sketch (missing values are ignored).
+
+        Parameters:
+            values: np.array
+                Values to add.
+        """
+
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+
+        if not len(values):
+            return self
+
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.under += int((values < self.lo).sum())
+        self.over += int((values > self.hi).sum())
+
+        inside = values[(values >= self.lo) & (values <= self.hi)]
+        idx = ((inside - self.lo) / (self.hi - self.lo) * self.n_bins).astype(np.int64)
+        self.counts += np.bincount(np.minimum(idx, self.n_bins-1), minlength=self.n_bins)
+
+        return self
+
+    def merge(self, other):
+        """
+        Add the counts from another sketch (with the same bins) to this one.
+
+        Parameters:
+            other: QuantileSketch
+                Sketch to merge in.
+        """
+
+        if (self.lo, self.hi, self.n_bins) != (other.lo, other.hi, other.n_bins):
+            raise ValueError('Sketches have different bins!')
+
+        self.counts += other.counts
+        self.under += other.under
+        self.over += other.over
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        return self
+
+    def _cum(self):
+        # Cumulative counts at each edge (with underflow/overflow lumped in
+        # between the observed min/max and the range).
+        edges = np.concatenate([[min(self.min, self.lo)], self.edges,
+                                [max(self.max, self.hi)]])
+        cum = np.concatenate([[0, self.under], self.under + np.cumsum(self.counts),
+                              [self.count]])
+
+        return edges, cum / max(self.count, 1)
+
+    def quantile(self, q):
+        """
+        Approximate quantile(s), interpolating linearly within bins.
+
+        Parameters:
+            q: float or np.array
+                Quantile(s) (as fractions).
+        """
+
+        if not self.count:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+
+        edges, cum = self._cum()
+        keep = np.append(True, np.diff(cum) > 0) # drop empty bins
+
+        return np.interp(q, cum[keep], edges[keep])
+
+    def cdf(self, x):
+        """
+        Approximate fraction of values less than or equal to x.
+
+        Parameters:
+            x: float or np.array
+                Value(s).
+        """
+
+        edges, cum = self._cum()
+
+        return np.interp(x, edges, cum, left=0., right=1.)
+
+    def to_dict(self):
+        nz = np.flatnonzero(self.counts)
+
+        return {
+            'lo': self.lo, 'hi': self.hi, 'n_bins': self.n_bins,
+            'bins': nz.tolist(), 'counts': self.counts[nz].tolist(),
+            'under': self.under, 'over': self.over,
+            'min': None if self.count == 0 else float(self.min),
+            'max': None if self.count == 0 else float(self.max)
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state['lo'], state['hi'], state['n_bins'])
+        sketch.counts[state['bins']] = state['counts']
+        sketch.under, sketch.over = state['under'], state['over']
+
+        if state['min'] is not None:
+            sketch.min, sketch.max = state['min'], state['max']
+
+        return sketch
+
+class RoleSketches:
+    """
+    Quantile sketches for each summary metric (see SKETCH_BINS), per punt
+    role.
+
+    Parameters:
+        bins: dict (keys: metrics, values: (lo, hi, n_bins)) (default SKETCH_BINS)
+            Bin layout for each metric.
+    """
+
+    def __init__(self, bins=SKETCH_BINS):
+
+        self.bins = dict(bins)
+        self.sketches = {}
+
+    def _sketch(self, role, metric):
+        key = (role, metric)
+
+        if key not in self.sketches:
+            self.sketches[key] = QuantileSketch(*self.bins[metric])
+
+        return self.sketches[key]
+
+    @property
+    def roles(self):
+        return sorted({role for role, _ in self.sketches})
+
+    def update(self, stats_df):
+        """
+        Add a table of summary statistics (see
+        collect_ngs_dynamics_data.summarize_windows) to the sketches.
+
+        Parameters:
+            stats_df: pd.DataFrame
+                Summary statistics (with Role).
+        """
+
+        metrics = [x for x in self.bins if x in stats_df.columns]
+
+        for role, role_df in stats_df.groupby('Role', sort=False):
+            for metric in metrics:
+                self._sketch(role, metric).add(role_df[metric].values)
+
+        return self
+
+    def merge(self, other):
+        """
+        Merge in the sketches from another RoleSketches.
+
+        Parameters:
+            other: RoleSketches
+                Sketches to merge in.
+        """
+
+        for (role, metric), sketch in other.sketches.items():
+            self._sketch(role, metric).merge(sketch)
+
+        return self
+
+    def quantile(self, role, metric, q):
+        """
+        Approximate quantile(s) of a metric for a role (None pools every role).
+
+        Parameters:
+            role: str
+                Punt role (None for all roles).
+            metric: str
+                Summary metric (e.g., max_s).
+            q: float or np.array
+                Quantile(s) (as fractions).
+        """
+
+        return self.pooled(metric).quantile(q) if role is None \
+            else self.sketches[(role, metric)].quantile(q)
+
+    def pooled(self, metric):
+        """
+        Sketch of a metric with every role merged together.
+
+        Parameters:
+            metric: str
+                Summary metric (e.g., max_s).
+        """
+
+        pooled = QuantileSketch(*self.bins[metric])
+
+        for (_, met), sketch in self.sketches.items():
+            if met == metric:
+                pooled.merge(sketch)
+
+        return pooled
+
+    def save(self, path):
+        """
+        Save sketches as JSON (via a temporary file).
+
+        Parameters:
+            path: str
+                Path to JSON file.
+        """
+
+        state = {
+            'bins': self.bins,
+            'sketches': {role: {met: sk.to_dict() for (r, met), sk in self.sketches.items() if r == role}
+                         for role in self.roles}
+        }
+
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load sketches saved with save().
+
+        Parameters:
+            path: str
+                Path to JSON file.
+        """
+
+        with open(path) as f:
+            state = json.load(f)
+
+        sketches = cls({met: tuple(b) for met, b in state['bins'].items()})
+
+        for role, role_state in state['sketches'].items():
+            for metric, sk_state in role_state.items():
+                sketches.sketches[(role, metric)] = QuantileSketch.from_dict(sk_state)
+
+        return sketches
@@ -0,0 +1,239 @@
+#
+# Binary store for per-player trajectories. Each column of the NGS data is
+# saved as one contiguous float32 array (.npy, memory-mapped on load), with the
+# rows for every player/play laid out back to back. An offset table (CSR
+# style) maps (Season_Year, GameKey, PlayID, GSISID) to the row range for that
+# player/play, so pulling out a trajectory is a slice rather than a boolean
+# mask over the full dataset.
+#
+# Author: Charlie Bonfield
+# Last Modified: 1/2019
+
+## IMPORTS
+import os
+import glob
+import json
+import numpy as np
+import pandas as pd
+
+from ngs_schema import _group_starts, read_ngs_csv
+
+## VARIABLES
+DDIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/data/'
+TDIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/data/trajectories/'
+
+KEY_COLS = ['Season_Year', 'GameKey', 'PlayID', 'GSISID']
+PLAY_COLS = ['Season_Year', 'GameKey', 'PlayID']
+FLOAT_COLS = ['t', 'x', 'y', 'dis', 'o', 'dir', 'vx', 'vy', 's', 'ax', 'ay', 'a']
+CATEGORY_COLS = ['Event', 'Identifier', 'Role']
+
+## FUNCTIONS
+def build_trajectory_store(ngs_df, store_dir):
+    """
+    Write NGS data to a trajectory store. Numeric columns are saved as float32
+    arrays, Time_ns (if present) as int64, and low-cardinality string columns
+    (Event, Identifier, Role) as integer codes plus a list of categories.
+    Rows with a missing key (e.g., no GSISID, which happens in the raw data)
+    can't be looked up, so they're left out.
+
+    Parameters:
+        ngs_df: pd.DataFrame
+            DataFrame containing NGS data (with relative time, t).
+        store_dir: str
+            Directory to write the store to (created if needed).
+    """
+
+    os.makedirs(store_dir, exist_ok=True)
+
+    # Lay out each player/play contiguously, in time order (keys may be
+    # nullable integers - see ngs_schema.py).
+    ngs_df = ngs_df.loc[ngs_df.loc[:, KEY_COLS].notnull().all(axis=1)]
+    ngs_df = ngs_df.sort_values(KEY_COLS + ['t'], kind='mergesort')
+    ngs_df.reset_index(drop=True, inplace=True)
+
+    new_grp = _group_starts(ngs_df, KEY_COLS)
+    starts = np.flatnonzero(new_grp)
+    offsets = np.append(starts, len(ngs_df)).astype(np.int64)
+    keys = ngs_df.loc[starts, KEY_COLS].to_numpy(dtype=np.int64)
+
+    np.save(f'{store_dir}/offsets.npy', offsets)
+    np.save(f'{store_dir}/keys.npy', keys)
+
+    # Save columns.
+    meta = {'float_cols': [], 'categories': {}, 'time_ns': False}
+
+    for col in FLOAT_COLS:
+        if col in ngs_df.columns:
+            np.save(f'{store_dir}/{col}.npy', ngs_df[col].values.astype(np.float32))
+            meta['float_cols'].append(col)
+
+    if 'Time_ns' in ngs_df.columns:
+        np.save(f'{store_dir}/Time_ns.npy', ngs_df.Time_ns.values.astype(np.int64))
+        meta['time_ns'] = True
+
+    for col in CATEGORY_COLS:
+        if col in ngs_df.columns:
+            cat = ngs_df[col].astype('category').cat
+            np.save(f'{store_dir}/{col}.npy', cat.codes.values.astype(np.int16))
+            meta['categories'][col] = [str(x) for x in cat.categories]
+
+    with open(f'{store_dir}/meta.json', 'w') as f:
+        json.dump(meta, f)
+
+    return len(keys)
+
+class TrajectoryStore:
+    """
+    Read-only view of a trajectory store (see build_trajectory_store). Column
+    arrays are memory-mapped, so only the trajectories that are actually
+    touched get read from disk.
+
+    Parameters:
+        store_dir: str
+            Directory containing the store.
+        columns: list (str) (default None)
+            Columns to load (None loads everything).
+    """
+
+    def __init__(self, store_dir, columns=None):
+
+        with open(f'{store_dir}/meta.json') as f:
+            meta = json.load(f)
+
+        self.offsets = np.load(f'{store_dir}/offsets.npy')
+        self.keys = np.load(f'{store_dir}/keys.npy')
+        self.categories = meta['categories']
+
+        avail_cols = meta['float_cols'] + list(self.categories)
+        if meta['time_ns']:
+            avail_cols.append('Time_ns')
+
+        self.columns = {
+            col: np.load(f'{store_dir}/{col}.npy', mmap_mode='r')
+            for col in avail_cols if columns is None or col in columns
+        }
+
+        # Player/play -> position in offset table, and play -> range of
+        # player/plays (players in a play are stored next to one another).
+        key_list = [tuple(x) for x in self.keys.tolist()]
+        self._lookup = {key: i for i, key in enumerate(key_list)}
+
+        self._plays = {}
+        for i, key in enumerate(key_list):
+            first, _ = self._plays.get(key[:3], (i, i))
+            self._plays[key[:3]] = (first, i+1)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return tuple(key) in self._lookup
+
+    def _rows(self, start, stop):
+        return {col: arr[start:stop] for col, arr in self.columns.items()}
+
+    def get(self, key):
+        """
+        Get the trajectory for a single player/play as a dictionary of column
+        arrays. These are views into the store (no copies are made).
+
+        Parameters:
+            key: tuple (ints)
+                (Season_Year, GameKey, PlayID, GSISID).
+        """
+
+        i = self._lookup[tuple(key)]
+
+        return self._rows(self.offsets[i], self.offsets[i+1])
+
+    def _frame(self, first, last):
+        start, stop = self.offsets[first], self.offsets[last]
+
+        # Repeat keys for every row in each player/play.
+        lengths = np.diff(self.offsets[first:last+1])
+        keys = np.repeat(self.keys[first:last], lengths, axis=0)
+        frame = pd.DataFrame(keys, columns=KEY_COLS)
+
+        for col, arr in self._rows(start, stop).items():
+            if col in self.categories:
+                frame[col] = pd.Categorical.from_codes(arr, self.categories[col])
+            elif col == 'Time_ns':
+                frame['Time'] = pd.to_datetime(arr)
+            else:
+                frame[col] = arr
+
+        return frame
+
+    def frame(self, key):
+        """
+        Get the trajectory for a single player/play as a DataFrame.
+
+        Parameters:
+            key: tuple (ints)
+                (Season_Year, GameKey, PlayID, GSISID).
+        """
+
+        i = self._lookup[tuple(key)]
+
+        return self._frame(i, i+1)
+
+    def play_frame(self, play_key):
+        """
+        Get the trajectories for every player in a play as a DataFrame.
+
+        Parameters:
+            play_key: tuple (ints)
+                (Season_Year, GameKey, PlayID).
+        """
+
+        first, last = self._plays[tuple(play_key)]
+
+        return self._frame(first, last)
+
+    def to_frame(self):
+        """
+        Get every trajectory in the store as a single DataFrame (in key order).
+        """
+
+        return self._frame(0, len(self))
+
+    def iter_players(self):
+        """
+        Step through all player/plays (in key order), yielding the key and a
+        dictionary of column arrays (views).
+        """
+
+        for i, key in enumerate(self.keys.tolist()):
+            yield tuple(key), self._rows(self.offsets[i], self.offsets[i+1])
+
+    def iter_player_frames(self):
+        """
+        Step through all player/plays (in key order), yielding the key and a
+        DataFrame.
+        """
+
+        for i, key in enumerate(self.keys.tolist()):
+            yield tuple(key), self._frame(i, i+1)
+
+    def iter_plays(self):
+        """
+        Step through all plays (in key order), yielding the key and a DataFrame
+        with all players in that play.
+        """
+
+        for play_key, (first, last) in self._plays.items():
+            yield play_key, self._frame(first, last)
+
+
+## MAIN
+if __name__ == '__main__':
+
+    # Build a store for each NGS dataset (with dynamics) and for the NGS data
+    # for the injury set.
+    files = sorted(glob.glob(f'{DDIR}wdynamics/*.csv'))
+    files.append(f'{DDIR}injury_ngs_data.csv')
+
+    for nfil in files:
+        print(os.path.basename(nfil))
+        name = os.path.basename(nfil).split('.csv')[0]
+        build_trajectory_store(read_ngs_csv(nfil), f'{TDIR}{name}')
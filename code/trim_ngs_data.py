@@ -1,31 +1,50 @@
 #
 # Script for trimming NGS data. Here, we pluck out NGS data only for the punt
-# plays in the injury/control sets.
+# plays in the injury/control sets (and any other lists of plays).
 #
 # Author: Charlie Bonfield
 # Last Modified: 12/2018
 
 ## IMPORTS
+import io
 import os
 import glob
 import math
+import time
+import heapq
+import itertools
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import ngs_schema
+from event_timeline import write_event_timeline
+from instrument import RunReport
+from manifest import Manifest, code_version
+from ngs_schema import apply_schema, read_dtypes, read_ngs_csv
+from ngs_store import read_ngs
+from preprocess_ngs_data import _line_game_key
 from preprocess_small_data import load_data
 
 
 ## VARIABLES
 WDIR = '/Users/cbonfield/Projects/kaggle/nfl_punts/'
 DDIR = f'{WDIR}data/wdynamics/'
+TDIR = f'{WDIR}data/trimmed/' # per-file trimmed data (reused if up to date)
+MER_COLS = ['Season_Year', 'GameKey', 'PlayID', 'GSISID']
+PLAY_LISTS = {} # extra sets of plays to pull out (keys: names, values: CSVs)
+N_WORKERS = 4 # number of NGS files trimmed at once
+USE_STORE = False # read from columnar store (see ngs_store.py) instead of CSVs
 
 
 ## FUNCTIONS
 def process_video_data(dict_key=None):
     """
     Clean up the injury data so that it's easy to pull out the NGS data for the
-    players of interest.
+    players of interest. The control set doesn't identify players, so for
+    video_control we just return the plays.
 
     Parameters:
         dict_key: str (default None)
@@ -35,6 +54,12 @@ def process_video_data(dict_key=None):
     ddict = load_data()
     vid_df = ddict[dict_key]
 
+    if 'GSISID' not in vid_df.columns:
+        play_df = vid_df.loc[:, ['Season_Year', 'GameKey', 'PlayId']]
+        play_df = play_df.drop_duplicates().sort_values(by=['Season_Year', 'GameKey', 'PlayId'])
+
+        return play_df.reset_index(drop=True)
+
     # Pull out columns relevant for player.
     play_df = vid_df.loc[:, ['Season_Year', 'GameKey', 'PlayId', 'GSISID']]
     play_df.loc[:, 'Identifier'] = 'PLAYER'
@@ -51,33 +76,319 @@ def process_video_data(dict_key=None):
 
     return both_df
 
+def _key_cols(key_df):
+    """
+    Key columns present in a key table: either full player/play keys, or just
+    play keys (in which case every player on the play matches).
+
+    Parameters:
+        key_df: pd.DataFrame
+            DataFrame containing keys of interest.
+    """
+
+    return [x for x in MER_COLS if x in key_df.columns]
+
+def extract_targets(file_path, targets, chunksize=1000000):
+    """
+    Pull out the NGS data for several sets of keys (e.g., injury set, control
+    set, any other list of plays) in a single pass over an NGS dataset. The
+    file is read in chunks of raw lines, which are first filtered on their
+    GameKey field (cheap); only those survivors are parsed and checked against
+    each set of keys. Only the matching rows are kept, so memory depends on
+    the chunk size and the number of matches rather than on the size of the
+    file.
+
+    Parameters:
+        file_path: str
+            Path to NGS dataset (CSV).
+        targets: dict (keys: names, values: DataFrames)
+            Key tables. Each must contain Season_Year, GameKey, PlayID, and
+            optionally GSISID; any other columns (e.g., Identifier) are
+            attached to the matching rows.
+        chunksize: int (default 1000000)
+            Number of lines read at a time.
+    """
+
+    game_keys = set()
+    wanted = {}
+
+    for name, key_df in targets.items():
+        key_cols = _key_cols(key_df)
+        game_keys.update(key_df.GameKey.tolist())
+        wanted[name] = (key_cols, pd.MultiIndex.from_frame(key_df.loc[:, key_cols].drop_duplicates()))
+
+    matches = {name: [] for name in targets}
+    dtypes = read_dtypes(file_path)
+
+    # Raw GameKey field -> whether the game is wanted (there are only a few
+    # hundred distinct fields, so each is only converted once).
+    keep = {b'': False}
+
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        col = header.rstrip(b'\r\n').split(b',').index(b'GameKey')
+
+        while True:
+            lines = list(itertools.islice(f, chunksize))
+            if not lines:
+                break
+
+            cand = []
+            for line in lines:
+                field = _line_game_key(line, col)
+                if field not in keep:
+                    keep[field] = float(field) in game_keys
+                if keep[field]:
+                    cand.append(line)
+
+            if not cand:
+                continue
+
+            cand = read_ngs_csv(io.BytesIO(header + b''.join(cand)), dtype=dtypes)
+
+            for name, (key_cols, keys) in wanted.items():
+                hits = pd.MultiIndex.from_frame(cand.loc[:, key_cols]).isin(keys)
+                if hits.any():
+                    matches[name].append(cand.loc[hits])
+
+    out_dict = {}
+
+    for name, key_df in targets.items():
+        # Chunks come with their own categories, so reapply the schema.
+        if matches[name]:
+            tmp_df = apply_schema(pd.concat(matches[name], ignore_index=True))
+        else:
+            tmp_df = read_ngs_csv(file_path, nrows=0)
+
+        key_cols = _key_cols(key_df)
+        out_dict[name] = key_df.merge(tmp_df, how='inner', left_on=key_cols,
+                                      right_on=key_cols)
+
+    return out_dict
+
+def read_matching_rows(file_path, key_df, chunksize=1000000):
+    """
+    Read only the rows of an NGS dataset whose keys appear in key_df (see
+    extract_targets).
+
+    Parameters:
+        file_path: str
+            Path to NGS dataset (CSV).
+        key_df: pd.DataFrame
+            DataFrame containing keys of interest.
+        chunksize: int (default 1000000)
+            Number of rows scanned at a time.
+    """
+
+    key_df = key_df.loc[:, _key_cols(key_df)].drop_duplicates()
+
+    return extract_targets(file_path, {'keys': key_df}, chunksize=chunksize)['keys']
+
+def read_store_target(key_df):
+    """
+    Pull out the NGS data for a set of keys from the columnar store (see
+    ngs_store.py) - only the games in key_df are read. The result has the same
+    layout as the trimmed CSVs ({name}_ngs_data.csv), sorted by key.
+
+    Parameters:
+        key_df: pd.DataFrame
+            Key table (see extract_targets).
+    """
+
+    key_cols = _key_cols(key_df)
+    ngs_df = read_ngs(season_year=key_df.Season_Year.unique(),
+                      game_keys=key_df.GameKey.unique())
+    ngs_df.drop('Season_Type', axis=1, inplace=True)
+
+    out_df = key_df.merge(ngs_df, how='inner', left_on=key_cols, right_on=key_cols)
+    out_df.sort_values(by=key_cols, kind='mergesort', inplace=True)
+
+    return out_df.reset_index(drop=True)
+
+def load_target_keys(dict_key):
+    """
+    Key table for the injury/control set (see process_video_data), with
+    columns named as in the NGS data.
+
+    Parameters:
+        dict_key: str
+            Options: video_injury, video_control
+    """
+
+    key_df = process_video_data(dict_key=dict_key)
+
+    return key_df.rename(index=str, columns={'PlayId':'PlayID'})
+
+def _trim_file(file_path, targets):
+    """
+    Run extract_targets on a single file, sorting each target's rows by key.
+    Returns the file path, the per-target DataFrames, and the elapsed time.
+
+    Parameters:
+        file_path: str
+            Path to NGS dataset (CSV).
+        targets: dict (keys: names, values: DataFrames)
+            Key tables (see extract_targets).
+    """
+
+    start = time.time()
+    out_dict = extract_targets(file_path, targets)
+
+    for name, tmp_df in out_dict.items():
+        tmp_df = tmp_df.sort_values(by=_key_cols(targets[name]), kind='mergesort')
+        out_dict[name] = tmp_df.reset_index(drop=True)
+
+    return file_path, out_dict, time.time() - start
+
+def trim_files(file_paths, targets, n_workers=None, use_threads=False):
+    """
+    Trim a set of NGS datasets in parallel (see extract_targets), printing the
+    time taken for each file. Results come back in the same order as
+    file_paths, with each target's rows sorted by key.
+
+    Parameters:
+        file_paths: list (str)
+            Paths to NGS datasets (CSV).
+        targets: dict (keys: names, values: DataFrames)
+            Key tables (see extract_targets).
+        n_workers: int (default None)
+            Number of workers (None uses all cores).
+        use_threads: bool (default False)
+            Boolean indicating whether to use a thread pool rather than a
+            process pool.
+    """
+
+    executor = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+
+    with executor(max_workers=n_workers) as pool:
+        futures = [pool.submit(_trim_file, fp, targets) for fp in file_paths]
+        results = []
+
+        for future in futures:
+            file_path, out_dict, elapsed = future.result()
+            print(f'{os.path.basename(file_path)}: {elapsed:.1f} s')
+            results.append(out_dict)
+
+    return results
+
+def kway_merge(frames, key_cols):
+    """
+    Merge DataFrames that are each already sorted by key_cols into a single
+    sorted DataFrame, without re-sorting everything. Ties are broken by the
+    order of the frames (then by row order), so the result is deterministic.
+
+    Parameters:
+        frames: list (pd.DataFrames)
+            DataFrames sorted by key_cols.
+        key_cols: list (str)
+            Columns to merge on.
+    """
+
+    frames = [x.reset_index(drop=True) for x in frames]
+    offsets = np.cumsum([0] + [len(x) for x in frames])
+
+    # Merge (keys, global row number) streams from each frame.
+    streams = [
+        zip(*[x[col].tolist() for col in key_cols], range(offsets[i], offsets[i+1]))
+        for i, x in enumerate(frames)
+    ]
+    order = [row[-1] for row in heapq.merge(*streams)]
+
+    out_df = pd.concat(frames, ignore_index=True)
+
+    return out_df.iloc[order].reset_index(drop=True)
+
 
 ## MAIN
 if __name__ == '__main__':
 
-    # Load in smaller datasets.
-    inj_df = process_video_data(dict_key='video_injury')
-    inj_df.rename(index=str, columns={'PlayId':'PlayID'}, inplace=True)
+    # Load in smaller datasets. Each set of keys gets its own output file
+    # ({name}_ngs_data.csv), and all of them are pulled in one pass over the
+    # NGS data. Extra lists of plays (CSV with Season_Year, GameKey, PlayID
+    # and optionally GSISID) can be added to PLAY_LISTS.
+    targets = {
+        'injury': load_target_keys('video_injury'),
+        'control': load_target_keys('video_control')
+    }
+    for name, pl_file in PLAY_LISTS.items():
+        targets[name] = pd.read_csv(pl_file)
+
+    for key_df in targets.values():
+        key_df.rename(index=str, columns={'PlayId':'PlayID'}, inplace=True)
+
+    # Step through entire set of NGS data (keeping track of where the time
+    # goes - see instrument.py).
+    ngs_dfs = {name: [] for name in targets}
+    report = RunReport('trim_ngs_data')
+
+    if USE_STORE:
+        # Only the games in the key sets need to be read.
+        for name, key_df in targets.items():
+            ngs_dfs[name].append(read_store_target(key_df))
+    else:
+        ngs_files = sorted(glob.glob(f'{DDIR}*.csv'))
+
+        # Only re-trim files that (or whose sets of keys) have changed.
+        manifest = Manifest(f'{TDIR}manifest.json')
+        code = code_version(__file__, ngs_schema.__file__)
+        params = {name: {'keys': key_df.to_csv(index=False)}
+                  for name, key_df in targets.items()}
+
+        for name in targets:
+            os.makedirs(f'{TDIR}{name}', exist_ok=True)
+
+        def _tfil(name, nfil):
+            return f'{TDIR}{name}/{os.path.basename(nfil)}'
+
+        # Figure out which files need to be (re)trimmed for which targets.
+        stale = {}
+
+        for nfil in ngs_files:
+            stale_targets = [
+                name for name in targets
+                if not manifest.is_current('trim_ngs_data', [nfil], [_tfil(name, nfil)],
+                                           params=params[name], code=code)
+            ]
+            if stale_targets:
+                stale[nfil] = stale_targets
+            else:
+                report['trim'].skip('up_to_date')
+
+        # Trim those files in parallel (all stale targets at once, so that
+        # each file is only read once).
+        with report.stage('trim') as stage:
+            stale_targets = {name for names in stale.values() for name in names}
+            results = trim_files(list(stale), {x: targets[x] for x in stale_targets},
+                                 n_workers=N_WORKERS)
+
+            for nfil, out_dict in zip(stale, results):
+                for name in stale[nfil]:
+                    out_dict[name].to_csv(_tfil(name, nfil), index=False)
+                    manifest.record('trim_ngs_data', [nfil], [_tfil(name, nfil)],
+                                    params=params[name], code=code)
+                    stage.rows(n_out=len(out_dict[name]))
+                stage.process()
 
-    # Step through entire set of NGS data.
-    ngs_dfs = []
-    mer_cols = ['Season_Year', 'GameKey', 'PlayID', 'GSISID']
-    ngs_files = glob.glob(f'{DDIR}*.csv')
+        # Per-file trimmed data is sorted, so it can just be merged.
+        with report.stage('load_trimmed') as stage:
+            for nfil in ngs_files:
+                for name in targets:
+                    ngs_dfs[name].append(read_ngs_csv(_tfil(name, nfil)))
+                    stage.rows(n_out=len(ngs_dfs[name][-1]))
 
-    for nfil in ngs_files:
-        print(os.path.basename(nfil))
-        ngs_df = pd.read_csv(nfil)
-        tmp_df = inj_df.merge(ngs_df, how='inner', left_on=mer_cols, right_on=mer_cols)
-        ngs_dfs.append(tmp_df)
+    # Save datasets.
+    with report.stage('merge_save') as stage:
+        for name, key_df in targets.items():
+            out_df = kway_merge(ngs_dfs[name], _key_cols(key_df))
 
-    # Save dataset.
-    out_df = pd.concat(ngs_dfs, ignore_index=True)
-    out_df.sort_values(by=mer_cols, inplace=True)
-    out_df.reset_index(drop=True, inplace=True)
+            out_df.to_csv(f'{WDIR}{name}_ngs_data.csv', index=False)
+            write_event_timeline(f'{WDIR}{name}_ngs_data.csv', out_df)
+            stage.rows(n_out=len(out_df))
+            stage.process(out_df.groupby(_key_cols(key_df)).ngroups)
 
-    out_df.to_csv(f'{WDIR}injury_ngs_data.csv', index=False)
+    report.write()
 
     # Load in set of NGS data for testing.
     #data = pd.read_csv(f'{DDIR}NGS-2017-pre.csv')
     #mer_cols = ['Season_Year', 'GameKey', 'PlayID', 'GSISID']
-    #test = inj_df.merge(data, how='inner', left_on=mer_cols, right_on=mer_cols)
+    #test = targets['injury'].merge(data, how='inner', left_on=mer_cols, right_on=mer_cols)
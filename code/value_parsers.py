@@ -0,0 +1,182 @@
+#
+# Memoized parsing for low-cardinality string columns (YardLine, team pairs,
+# scores, weather/turf descriptions, ...). Each column is factorized, the
+# parser only runs on the distinct values, and the results are broadcast back
+# to every row through the codes. Parsed values can be kept in a ParseCache,
+# which is saved as JSON so later runs only parse values they haven't seen.
+#
+# Author: Charlie Bonfield
+# Last Modified: 1/2019
+
+## IMPORTS
+import os
+import json
+import inspect
+import numpy as np
+import pandas as pd
+
+from manifest import params_version
+
+## FUNCTIONS
+def _cache_key(value):
+    # JSON key for a (scalar or tuple) value.
+    if isinstance(value, tuple):
+        value = [x.item() if isinstance(x, np.generic) else x for x in value]
+    elif isinstance(value, np.generic):
+        value = value.item()
+
+    return json.dumps(value, default=str)
+
+def parser_version(parser, params=None):
+    """
+    Hash of the source of the module a parser is defined in (and any
+    parameters it depends on, such as a rule table), so cached values are
+    dropped when the parser changes. The whole module is hashed, since
+    parsers can lean on helpers and constants defined next to them.
+
+    Parameters:
+        parser: function
+            Parser.
+        params: object (default None)
+            JSON-serializable parameters used by the parser.
+    """
+
+    return params_version({'source': inspect.getsource(inspect.getmodule(parser)),
+                           'params': params})
+
+class ParseCache:
+    """
+    Parsed values for any number of parsers, keyed by parser name and version
+    (see parser_version).
+
+    Parameters:
+        path: str (default None)
+            Path to JSON file (None keeps the cache in memory only).
+    """
+
+    def __init__(self, path=None):
+
+        self.path = path
+        self.entries = {}
+        self._dirty = False
+
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def lookup(self, name, version):
+        """
+        Parsed values (keys: JSON-encoded values, values: results) for a
+        parser. Entries for older versions of the parser are dropped.
+
+        Parameters:
+            name: str
+                Name of parser.
+            version: str
+                Parser version.
+        """
+
+        entry = self.entries.get(name)
+
+        if entry is None or entry['version'] != version:
+            entry = self.entries[name] = {'version': version, 'values': {}}
+            self._dirty = True
+
+        return entry['values']
+
+    def add(self, name, values):
+        """
+        Add newly parsed values for a parser (see lookup).
+
+        Parameters:
+            name: str
+                Name of parser.
+            values: dict (keys: JSON-encoded values, values: results)
+                Parsed values.
+        """
+
+        if values:
+            self.entries[name]['values'].update(values)
+            self._dirty = True
+
+    def save(self):
+        """
+        Write the cache to disk (via a temporary file), if anything changed.
+        """
+
+        if self.path is None or not self._dirty:
+            return
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+        self._dirty = False
+
+def parse_unique(values, parser, columns=None, cache=None, params=None):
+    """
+    Apply a parser to every row of a column (or set of columns), running it
+    only once per distinct value. Missing values are never parsed (their
+    results are nan).
+
+    Parameters:
+        values: pd.Series or pd.DataFrame
+            Column to parse. For a DataFrame, the parser is called with one
+            argument per column.
+        parser: function
+            Parser for a single value. Returns a scalar, or a tuple if columns
+            is given.
+        columns: list (str) (default None)
+            Names of the fields returned by parser (None if it returns a
+            scalar).
+        cache: ParseCache (default None)
+            Cache of previously parsed values.
+        params: object (default None)
+            JSON-serializable parameters used by parser (see parser_version).
+    """
+
+    if isinstance(values, pd.DataFrame):
+        # Rows with any missing value are left out (code -1).
+        valid = values.notnull().all(axis=1).values
+        codes = np.full(len(values), -1, dtype=np.intp)
+        codes[valid], uniques = pd.MultiIndex.from_frame(values.loc[valid]).factorize()
+        uniques, unpack = list(uniques), True
+    else:
+        codes, uniques = pd.factorize(values)
+        uniques, unpack = list(uniques), False
+
+    known = {}
+    if cache is not None:
+        name = f'{parser.__module__}.{parser.__qualname__}'
+        known = cache.lookup(name, parser_version(parser, params))
+
+    parsed, new = [], {}
+    for value in uniques:
+        key = _cache_key(value)
+
+        if key in known:
+            result = known[key]
+        else:
+            result = parser(*value) if unpack else parser(value)
+            new[key] = result
+
+        parsed.append(tuple(result) if columns is not None else result)
+
+    if cache is not None:
+        cache.add(name, new)
+
+    # Missing values get code -1, which picks out the (nan) row on the end.
+    if (codes < 0).any():
+        parsed.append((np.nan,)*len(columns) if columns is not None else np.nan)
+
+    if columns is not None:
+        table = pd.DataFrame(parsed, columns=columns)
+        out = table.take(codes).set_axis(values.index, axis=0)
+    else:
+        table = pd.Series(parsed, dtype=None if parsed else object)
+        out = pd.Series(table.values[codes], index=values.index)
+
+    return out